@@ -30,6 +30,7 @@ setup(
                              'sphinx-autodoc-typehints==1.11.0',
                              'sphinx-versions==1.0.1',
                              'click==8.0.4'],
+                    're2': ['google-re2'],
                     'tests': ['nose2', 'numpy']},
     test_suite='nose2.collector.collector',
     tests_require=['nose2', 'numpy'],
@@ -1,6 +1,8 @@
 import unittest
+from string import digits, punctuation
 
-from text_scrubber.geo.clean import _clean_geo_string
+from text_scrubber import TextScrubber
+from text_scrubber.geo.clean import _clean_geo_string, _clean_geo_string_cached, _GEO_TOKEN_MAP
 
 
 class CleanGeoStringTest(unittest.TestCase):
@@ -103,3 +105,38 @@ class CleanGeoStringTest(unittest.TestCase):
         for original, expected in test_input:
             with self.subTest(original=original, expected=expected):
                 self.assertEqual(_clean_geo_string(original), expected)
+
+    def test_cached(self):
+        """
+        Single strings should only be cleaned once. Lists should give the same results as cleaning each string
+        """
+        _clean_geo_string_cached.cache_clear()
+        self.assertEqual(_clean_geo_string('The Netherlands'), 'netherlands')
+        self.assertEqual(_clean_geo_string('The Netherlands'), 'netherlands')
+        self.assertEqual(_clean_geo_string_cached.cache_info().hits, 1)
+        self.assertEqual(_clean_geo_string(['The Netherlands', 'ITALY']), ['netherlands', 'italy'])
+
+    def test_same_as_text_scrubber(self):
+        """
+        Cleaning is done in a single function for speed. It should give the same results as the equivalent pipeline
+        """
+        translation_table = str.maketrans({**{char: None for char in digits + punctuation},
+                                           **{char: ' ' for char in '-/&,'}})
+        text_scrubber = (TextScrubber().to_ascii()
+                                       .text_transform(lambda s: s.translate(translation_table))
+                                       .tokenize(str.split)
+                                       .remove_stop_words({'a', 'an', 'and', 'der', 'da', 'di', 'do', 'e', 'le', 'im',
+                                                           'mail'}, case_sensitive=True)
+                                       .lowercase(on_tokens=True)
+                                       .filter_tokens()
+                                       .sub_tokens(lambda token: _GEO_TOKEN_MAP.get(token, token))
+                                       .remove_stop_words({'cedex', 'email', 'of', 'the'})
+                                       .join())
+        test_input = ['The City of New York, NY', 'St-Petersburg', 'A DO Le le THE The of OF Email cedex CEDEX',
+                      'MAIL mail Mail', 'Rép. Démocratique du Congo', 'Σωκράτης 北京', '12 rue / x&y', '',
+                      '   ', "O'Brien\tNEW\x1fYORK\x00", 'Saint-Étienne (42)']
+        _clean_geo_string_cached.cache_clear()
+        for original in test_input:
+            with self.subTest(original=original):
+                self.assertEqual(_clean_geo_string(original), text_scrubber.transform(original))
+        self.assertEqual(_clean_geo_string(test_input), text_scrubber.transform(test_input))
@@ -1,10 +1,53 @@
 import unittest
 
-from text_scrubber.geo.find_in_string import (ExtractedLocation, find_city_in_string, find_country_in_string,
-                                              find_region_in_string, Range)
+from text_scrubber.geo.find_in_string import (_find_in_string, _find_in_string_cached, ExtractedLocation,
+                                              find_city_in_string, find_country_in_string, find_region_in_string,
+                                              Range)
 from text_scrubber.geo.normalize import Location
 
 
+class FindInStringTest(unittest.TestCase):
+    def test_overlap_resolution(self):
+        """
+        Overlap between matches should be resolved by score, then by length of the normalized name, then by length of
+        the substring. A match with a lower score should never dismiss a match with a higher score
+        """
+        locations = {'t1 t2': Location(canonical_name="Aaaa", matched_name="Aaaa", country=None, score=1.0),
+                     't2 t3': Location(canonical_name="Bbbbb", matched_name="Bbbbb", country=None, score=1.0),
+                     't3 t4': Location(canonical_name="Cccccc", matched_name="Cccccc", country=None, score=1.0),
+                     't0 t1': Location(canonical_name="Dddddd", matched_name="Dddddd", country=None, score=0.9)}
+
+        def normalize_func(combination, **kwargs):
+            return [locations[combination]] if combination in locations else []
+
+        self.assertEqual(_find_in_string("t0 t1 t2 t3 t4", str.lower, normalize_func, set(), set(),
+                                         max_tokens_to_consider=3),
+                         [ExtractedLocation(location=locations['t1 t2'], substring='t1 t2',
+                                            substring_range=Range(3, 8)),
+                          ExtractedLocation(location=locations['t3 t4'], substring='t3 t4',
+                                            substring_range=Range(9, 14))])
+
+    def test_results_are_cached(self):
+        """
+        Extracted locations should be cached per sample. Each call should return a new list, such that altering the
+        result doesn't alter the cache
+        """
+        _find_in_string_cached.cache_clear()
+        sample = "Fur Museum, 7884 Fur, Denmark."
+        for find_func, country_set in [(find_country_in_string, None), (find_city_in_string, {"Denmark"}),
+                                       (find_region_in_string, {"Denmark"})]:
+            with self.subTest(find_func=find_func):
+                args = (sample,) if country_set is None else (sample, country_set)
+                first = find_func(*args)
+                hits = _find_in_string_cached.cache_info().hits
+                second = find_func(*args)
+                self.assertEqual(_find_in_string_cached.cache_info().hits, hits + 1)
+                self.assertEqual(first, second)
+                self.assertIsNot(first, second)
+                first.clear()
+                self.assertEqual(find_func(*args), second)
+
+
 class FindCountryInStringTest(unittest.TestCase):
     def test_find_single_country_in_string(self):
         """
@@ -260,6 +303,23 @@ class FindCountryInStringTest(unittest.TestCase):
                 extracted_country = find_country_in_string(original)
                 self.assertEqual(extracted_country, expected_match)
 
+    def test_substring_range_other_whitespace(self):
+        """
+        The substring range should point to the substring in the original sample, also when tokens are separated by
+        other whitespace than single spaces
+        """
+        test_samples = [
+            ("  Fur Museum,\t7884  Fur,\n Denmark.", "Denmark", Range(26, 33)),
+            ("University of\tAmsterdam,  The   Netherlands", "Netherlands", Range(32, 43)),
+            ("Institute of Plant Sciences, Bern\t\t3005,  Switzerl.", "Switzerl", Range(42, 50))
+        ]
+        for original, expected_substring, expected_range in test_samples:
+            with self.subTest(original=original):
+                extracted_country, = find_country_in_string(original)
+                self.assertEqual(extracted_country.substring, expected_substring)
+                self.assertEqual(extracted_country.substring_range, expected_range)
+                self.assertEqual(original[expected_range.start:expected_range.end], expected_substring)
+
 
 class FindCityInStringTest(unittest.TestCase):
     def test_find_multiple_cities_in_string(self):
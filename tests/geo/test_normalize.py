@@ -1,8 +1,10 @@
 import unittest
 from unittest.mock import patch
 
-from text_scrubber.geo.normalize import (capitalize_geo_string, Location, normalize_city, normalize_country,
-                                         normalize_region)
+from text_scrubber.geo.normalize import (_find_closest_cities, _find_closest_countries, _find_closest_regions,
+                                         _get_country_codes, capitalize_geo_string, Location, normalize_city,
+                                         normalize_city_batch, normalize_country, normalize_region,
+                                         process_multiple_names)
 from text_scrubber.geo.string_distance import find_closest_string
 
 
@@ -149,9 +151,35 @@ class NormalizeCountryTest(unittest.TestCase):
         for min_score_levenshtein, min_score_trigram in [(0.8, 0.5), (0.5, 0.8), (0.1, 0.1)]:
             with self.subTest(min_score_levenshtein=min_score_levenshtein, min_score_trigram=min_score_trigram), \
                     patch('text_scrubber.geo.normalize.find_closest_string', side_effect=find_closest_string) as p:
+                _find_closest_countries.cache_clear()
                 normalize_country('a country name', min_score_levenshtein, min_score_trigram)
                 self.assertEqual(p.call_args[0][-2:], (min_score_levenshtein, min_score_trigram))
 
+    def test_cached(self):
+        """
+        Inputs that are equal after cleaning should only be looked up once. Each call should return a new list
+        """
+        _find_closest_countries.cache_clear()
+        with patch('text_scrubber.geo.normalize.find_closest_string', side_effect=find_closest_string) as p:
+            first = normalize_country('Netherlnds')
+            n_calls = p.call_count
+            self.assertGreater(n_calls, 0)
+            second = normalize_country('  NETHERLNDS ')
+            self.assertEqual(p.call_count, n_calls)
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
+    def test_exact_match_location_is_shared(self):
+        """
+        Exact matches should return the same (immutable) Location object each time, in a new list
+        """
+        first = normalize_country('Netherlands')
+        second = normalize_country('netherlands')
+        self.assertEqual(first, [Location(canonical_name='Netherlands', matched_name='Netherlands', country=None,
+                                          score=1.0)])
+        self.assertIsNot(first, second)
+        self.assertIs(first[0], second[0])
+
 
 class NormalizeRegionTest(unittest.TestCase):
 
@@ -274,9 +302,24 @@ class NormalizeRegionTest(unittest.TestCase):
         for min_score_levenshtein, min_score_trigram in [(0.8, 0.5), (0.5, 0.8), (0.1, 0.1)]:
             with self.subTest(min_score_levenshtein=min_score_levenshtein, min_score_trigram=min_score_trigram), \
                     patch('text_scrubber.geo.normalize.find_closest_string', side_effect=find_closest_string) as p:
+                _find_closest_regions.cache_clear()
                 normalize_region('a region name', {'NL'}, min_score_levenshtein, min_score_trigram)
                 self.assertEqual(p.call_args[0][-2:], (min_score_levenshtein, min_score_trigram))
 
+    def test_cached(self):
+        """
+        Inputs that are equal after cleaning should only be looked up once. Each call should return a new list
+        """
+        _find_closest_regions.cache_clear()
+        with patch('text_scrubber.geo.normalize.find_closest_string', side_effect=find_closest_string) as p:
+            first = normalize_region('Noord Holand', {'NL'})
+            n_calls = p.call_count
+            self.assertGreater(n_calls, 0)
+            second = normalize_region('noord-HOLAND', {'Netherlands'})
+            self.assertEqual(p.call_count, n_calls)
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
 
 class NormalizeCityTest(unittest.TestCase):
 
@@ -468,9 +511,99 @@ class NormalizeCityTest(unittest.TestCase):
         for min_score_levenshtein, min_score_trigram in [(0.8, 0.5), (0.5, 0.8), (0.1, 0.1)]:
             with self.subTest(min_score_levenshtein=min_score_levenshtein, min_score_trigram=min_score_trigram), \
                     patch('text_scrubber.geo.normalize.find_closest_string', side_effect=find_closest_string) as p:
+                _find_closest_cities.cache_clear()
                 normalize_city('a city name', {'NL'}, min_score_levenshtein, min_score_trigram)
                 self.assertEqual(p.call_args[0][-2:], (min_score_levenshtein, min_score_trigram))
 
+    def test_cached(self):
+        """
+        Inputs that are equal after cleaning should only be looked up once. Each call should return a new list
+        """
+        _find_closest_cities.cache_clear()
+        with patch('text_scrubber.geo.normalize.find_closest_string', side_effect=find_closest_string) as p:
+            first = normalize_city('Amsterdm', {'NL'})
+            n_calls = p.call_count
+            self.assertGreater(n_calls, 0)
+            second = normalize_city('AMSTERDM ', {'Netherlands'})
+            self.assertEqual(p.call_count, n_calls)
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
+    def test_restrict_countries_resolved_once(self):
+        """
+        The countries to search in should only be normalized once for the same set of countries
+        """
+        _get_country_codes.cache_clear()
+        with patch('text_scrubber.geo.normalize.normalize_country_to_country_codes',
+                   return_value={'DK', 'FO', 'GL'}) as p:
+            normalize_city('Fur', {'Denmark'})
+            normalize_city('Copenhagen', ['Denmark'])
+            self.assertEqual(p.call_count, 1)
+        _get_country_codes.cache_clear()
+
+
+class NormalizeCityBatchTest(unittest.TestCase):
+
+    def test_part_of_known_cities(self):
+        """
+        Test batch input that is part of the cities map
+        """
+        test_cities = [
+            ("Booleroo", [("Booleroo", "Australia", 1)]),
+            ("Leibnitz", [("Leibnitz", "Austria", 1)]),
+            ("ivry-sur-seine", [("Ivry-sur-Seine", "France", 1)]),
+            ("Birjand", [("Bīrjand", "Iran", 1)]),
+        ]
+        originals = [original for original, _ in test_cities]
+        results = normalize_city_batch(originals, {"Australia", "Austria", "FR", "IR"})
+        for (original, expected), matches in zip(test_cities, results):
+            with self.subTest(original=original, expected=expected):
+                self.assertEqual(matches, [Location(city, city, country, score) for city, country, score in expected])
+
+    def test_same_as_normalize_city(self):
+        """
+        Results should be the same as calling normalize_city for each input, including duplicates, close matches, and
+        inputs that are empty after cleaning
+        """
+        originals = ["Toranto", "*", "Dallaas", "toronto", "Toranto", "plznoname"]
+        country_set = {"Canada", "US"}
+        results = normalize_city_batch(originals, country_set)
+        self.assertEqual(len(results), len(originals))
+        for original, matches in zip(originals, results):
+            with self.subTest(original=original):
+                self.assertEqual(matches, normalize_city(original, country_set))
+
+        # Each result should be a separate list
+        self.assertIsNot(results[0], results[4])
+
+    def test_empty(self):
+        """
+        An empty batch should return an empty list
+        """
+        self.assertEqual(normalize_city_batch([]), [])
+
+
+class ProcessMultipleNamesTest(unittest.TestCase):
+
+    def test_process_multiple_names(self):
+        """
+        The candidate with the most non-ascii characters should be selected, then the longest one, then the one with the
+        shortest matched name, and then the first one in alphabetical order
+        """
+        test_input = [
+            ([("Chenet", "Chenet"), ("Chênet", "Chênet")], 1),
+            ([("Etten", "Etten"), ("Etten-Leur", "Etten-Leur")], 1),
+            ([("Netherlands", "The Netherlands"), ("Netherlands", "Netherlands")], 1),
+            ([("Bbb", "Bbb"), ("Aaa", "Aaa"), ("Ccc", "Ccc")], 1),
+            ([("Aaa", "Aaa"), ("Aaa", "Aaa")], 0),
+            ([("Aaa", "Aaa")], 0),
+        ]
+        for names, expected_idx in test_input:
+            with self.subTest(names=names, expected_idx=expected_idx):
+                candidates = [Location(canonical_name=canonical_name, matched_name=matched_name, country=None,
+                                       score=1.0) for canonical_name, matched_name in names]
+                self.assertIs(process_multiple_names(candidates), candidates[expected_idx])
+
 
 class CapitalizeGeoStringTest(unittest.TestCase):
 
@@ -1,6 +1,21 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
 import unittest
+from unittest.mock import patch
 
-from text_scrubber.geo.resources import add_city_resources, add_country_resources, add_region_resources
+import numpy as np
+
+from text_scrubber.geo import string_distance_levenshtein, string_distance_trigrams
+from text_scrubber.geo.resources import (_DEFAULT_GEO_INDEX_DIR, _GEO_INDEX_ALIGNMENT, _GEO_INDEX_VERSION,
+                                         _get_geo_index_dir, _load_geo_index, _load_indexed_location_resources,
+                                         _open_for_replace, add_city_resources, add_country_resources,
+                                         add_region_resources, build_geo_index)
+from text_scrubber.geo.string_distance import find_closest_string
+
+MODULE_NAME = 'text_scrubber.geo.resources'
 
 
 class AddCountryResourcesTest(unittest.TestCase):
@@ -15,12 +30,14 @@ class AddCountryResourcesTest(unittest.TestCase):
 
         self.assertListEqual(sorted(_COUNTRY_RESOURCES.keys()),
                              ['all_country_codes', 'countries', 'country_to_normalized_country_map',
-                              'normalized_country_to_country_codes_map', 'replacement_patterns'])
+                              'normalized_country_to_country_codes_map', 'replacement_pattern',
+                              'replacement_pattern_map'])
         self.assertIsInstance(_COUNTRY_RESOURCES['all_country_codes'], set)
         self.assertIsInstance(_COUNTRY_RESOURCES['countries'], dict)
         self.assertIsInstance(_COUNTRY_RESOURCES['country_to_normalized_country_map'], dict)
         self.assertIsInstance(_COUNTRY_RESOURCES['normalized_country_to_country_codes_map'], dict)
-        self.assertIsInstance(_COUNTRY_RESOURCES['replacement_patterns'], list)
+        self.assertIsInstance(_COUNTRY_RESOURCES['replacement_pattern'], re.Pattern)
+        self.assertIsInstance(_COUNTRY_RESOURCES['replacement_pattern_map'], dict)
 
         self.assertListEqual(sorted(_COUNTRY_RESOURCES['countries'].keys()),
                              ['canonical_names', 'cleaned_location_map', 'levenshtein', 'trigrams'])
@@ -28,8 +45,8 @@ class AddCountryResourcesTest(unittest.TestCase):
         self.assertIsInstance(_COUNTRY_RESOURCES['countries']['trigrams'], dict)
         for size_dict in _COUNTRY_RESOURCES['countries']['levenshtein'].values():
             self.assertListEqual(sorted(size_dict.keys()), ['char_matrix', 'indices', 'levenshtein_tokens'])
-        for size_dict in _COUNTRY_RESOURCES['countries']['trigrams'].values():
-            self.assertListEqual(sorted(size_dict.keys()), ['indices', 'trigram_tokens'])
+        self.assertListEqual(sorted(_COUNTRY_RESOURCES['countries']['trigrams'].keys()),
+                             ['indices', 'n_tokens', 'size_offsets', 'trigram_postings', 'trigram_tokens'])
 
     def test_indices(self):
         """
@@ -45,9 +62,8 @@ class AddCountryResourcesTest(unittest.TestCase):
         for size_dict in country_dict['levenshtein'].values():
             self.assertTrue(all(0 <= idx <= max_idx and 0 <= canonical_name_idx <= max_idx
                                 for canonical_name_idx, idx in size_dict['indices']))
-        for size_dict in country_dict['trigrams'].values():
-            self.assertTrue(all(0 <= idx <= max_idx and 0 <= canonical_name_idx <= max_idx
-                                for canonical_name_idx, idx in size_dict['indices']))
+        self.assertTrue(all(0 <= idx <= max_idx and 0 <= canonical_name_idx <= max_idx
+                            for canonical_name_idx, idx in country_dict['trigrams']['indices']))
 
     def test_bounds(self):
         """
@@ -60,8 +76,9 @@ class AddCountryResourcesTest(unittest.TestCase):
         for size_dict in country_dict['levenshtein'].values():
             self.assertEqual(len(size_dict['indices']), len(size_dict['levenshtein_tokens']))
             self.assertEqual(len(size_dict['indices']), size_dict['char_matrix'].shape[0])
-        for size_dict in country_dict['trigrams'].values():
-            self.assertEqual(len(size_dict['indices']), size_dict['trigram_tokens'].shape[0])
+        self.assertEqual(len(country_dict['trigrams']['indices']), country_dict['trigrams']['trigram_tokens'].shape[0])
+        self.assertEqual(country_dict['trigrams']['size_offsets'][-1],
+                         country_dict['trigrams']['trigram_tokens'].shape[0])
 
 
 class AddRegionResourcesTest(unittest.TestCase):
@@ -84,8 +101,8 @@ class AddRegionResourcesTest(unittest.TestCase):
         self.assertIsInstance(_REGION_RESOURCES['regions_per_country_code_map']['NL']['trigrams'], dict)
         for size_dict in _REGION_RESOURCES['regions_per_country_code_map']['NL']['levenshtein'].values():
             self.assertListEqual(sorted(size_dict.keys()), ['char_matrix', 'indices', 'levenshtein_tokens'])
-        for size_dict in _REGION_RESOURCES['regions_per_country_code_map']['NL']['trigrams'].values():
-            self.assertListEqual(sorted(size_dict.keys()), ['indices', 'trigram_tokens'])
+        self.assertListEqual(sorted(_REGION_RESOURCES['regions_per_country_code_map']['NL']['trigrams'].keys()),
+                             ['indices', 'n_tokens', 'size_offsets', 'trigram_postings', 'trigram_tokens'])
 
     def test_indices(self):
         """
@@ -101,9 +118,8 @@ class AddRegionResourcesTest(unittest.TestCase):
         for size_dict in region_dict['levenshtein'].values():
             self.assertTrue(all(0 <= idx <= max_idx and 0 <= canonical_name_idx <= max_idx
                                 for canonical_name_idx, idx in size_dict['indices']))
-        for size_dict in region_dict['trigrams'].values():
-            self.assertTrue(all(0 <= idx <= max_idx and 0 <= canonical_name_idx <= max_idx
-                                for canonical_name_idx, idx in size_dict['indices']))
+        self.assertTrue(all(0 <= idx <= max_idx and 0 <= canonical_name_idx <= max_idx
+                            for canonical_name_idx, idx in region_dict['trigrams']['indices']))
 
     def test_bounds(self):
         """
@@ -116,8 +132,9 @@ class AddRegionResourcesTest(unittest.TestCase):
         for size_dict in region_dict['levenshtein'].values():
             self.assertEqual(len(size_dict['indices']), len(size_dict['levenshtein_tokens']))
             self.assertEqual(len(size_dict['indices']), size_dict['char_matrix'].shape[0])
-        for size_dict in region_dict['trigrams'].values():
-            self.assertEqual(len(size_dict['indices']), size_dict['trigram_tokens'].shape[0])
+        self.assertEqual(len(region_dict['trigrams']['indices']), region_dict['trigrams']['trigram_tokens'].shape[0])
+        self.assertEqual(region_dict['trigrams']['size_offsets'][-1],
+                         region_dict['trigrams']['trigram_tokens'].shape[0])
 
 
 class AddCityResourcesTest(unittest.TestCase):
@@ -140,8 +157,8 @@ class AddCityResourcesTest(unittest.TestCase):
         self.assertIsInstance(_CITY_RESOURCES['cities_per_country_code_map']['NL']['trigrams'], dict)
         for size_dict in _CITY_RESOURCES['cities_per_country_code_map']['NL']['levenshtein'].values():
             self.assertListEqual(sorted(size_dict.keys()), ['char_matrix', 'indices', 'levenshtein_tokens'])
-        for size_dict in _CITY_RESOURCES['cities_per_country_code_map']['NL']['trigrams'].values():
-            self.assertListEqual(sorted(size_dict.keys()), ['indices', 'trigram_tokens'])
+        self.assertListEqual(sorted(_CITY_RESOURCES['cities_per_country_code_map']['NL']['trigrams'].keys()),
+                             ['indices', 'n_tokens', 'size_offsets', 'trigram_postings', 'trigram_tokens'])
 
     def test_indices(self):
         """
@@ -157,9 +174,8 @@ class AddCityResourcesTest(unittest.TestCase):
         for size_dict in city_dict['levenshtein'].values():
             self.assertTrue(all(0 <= idx <= max_idx and 0 <= canonical_name_idx <= max_idx
                                 for canonical_name_idx, idx in size_dict['indices']))
-        for size_dict in city_dict['trigrams'].values():
-            self.assertTrue(all(0 <= idx <= max_idx and 0 <= canonical_name_idx <= max_idx
-                                for canonical_name_idx, idx in size_dict['indices']))
+        self.assertTrue(all(0 <= idx <= max_idx and 0 <= canonical_name_idx <= max_idx
+                            for canonical_name_idx, idx in city_dict['trigrams']['indices']))
 
     def test_bounds(self):
         """
@@ -172,5 +188,189 @@ class AddCityResourcesTest(unittest.TestCase):
         for size_dict in city_dict['levenshtein'].values():
             self.assertEqual(len(size_dict['indices']), len(size_dict['levenshtein_tokens']))
             self.assertEqual(len(size_dict['indices']), size_dict['char_matrix'].shape[0])
-        for size_dict in city_dict['trigrams'].values():
-            self.assertEqual(len(size_dict['indices']), size_dict['trigram_tokens'].shape[0])
+        self.assertEqual(len(city_dict['trigrams']['indices']), city_dict['trigrams']['trigram_tokens'].shape[0])
+        self.assertEqual(city_dict['trigrams']['size_offsets'][-1],
+                         city_dict['trigrams']['trigram_tokens'].shape[0])
+
+
+class BuildGeoIndexTest(unittest.TestCase):
+
+    def test_build_and_load(self):
+        """
+        A prebuilt index should contain the same resources as the ones parsed from the resource files
+        """
+        from text_scrubber.geo.resources import _CITY_RESOURCES, _COUNTRY_RESOURCES, _REGION_RESOURCES
+
+        with tempfile.TemporaryDirectory() as index_dir:
+            build_geo_index({'NL'}, index_dir=index_dir)
+            for resource_name in ('vocabularies.pkl', 'countries.pkl', 'countries.pkl.bin',
+                                  os.path.join('regions', 'NL.pkl'), os.path.join('regions', 'NL.pkl.bin'),
+                                  os.path.join('cities', 'NL.pkl'), os.path.join('cities', 'NL.pkl.bin')):
+                self.assertTrue(os.path.exists(os.path.join(index_dir, resource_name)))
+            expected_levenshtein_map = dict(string_distance_levenshtein._LEVENSHTEIN_MAP)
+            expected_trigram_map = dict(string_distance_trigrams._TRIGRAM_MAP)
+
+            with patch.object(string_distance_levenshtein, '_LEVENSHTEIN_MAP', new={}) as levenshtein_map, \
+                    patch.object(string_distance_trigrams, '_TRIGRAM_MAP', new={}) as trigram_map, \
+                    patch(f'{MODULE_NAME}._GEO_INDEX_DIR', new=None):
+                _load_geo_index(index_dir)
+                self.assertDictEqual(levenshtein_map, expected_levenshtein_map)
+                self.assertDictEqual(trigram_map, expected_trigram_map)
+
+                for resource_name, expected in (('countries.pkl', _COUNTRY_RESOURCES['countries']),
+                                                (os.path.join('regions', 'NL.pkl'),
+                                                 _REGION_RESOURCES['regions_per_country_code_map']['NL']),
+                                                (os.path.join('cities', 'NL.pkl'),
+                                                 _CITY_RESOURCES['cities_per_country_code_map']['NL'])):
+                    with self.subTest(resource_name=resource_name):
+                        location_dict = _load_indexed_location_resources(resource_name)
+                        self.assertListEqual(location_dict['canonical_names'], expected['canonical_names'])
+                        self.assertDictEqual(location_dict['cleaned_location_map'], expected['cleaned_location_map'])
+                        self.assertListEqual(location_dict['trigrams']['indices'], expected['trigrams']['indices'])
+                        np.testing.assert_array_equal(location_dict['trigrams']['trigram_tokens'].indices,
+                                                      expected['trigrams']['trigram_tokens'].indices)
+
+    def test_index_is_read_only(self):
+        """
+        Arrays in the index should be memory-mapped and, therefore, read-only. The similarity functions should work on
+        them as usual
+        """
+        from text_scrubber.geo.resources import _CITY_RESOURCES
+
+        with tempfile.TemporaryDirectory() as index_dir:
+            build_geo_index({'NL'}, index_dir=index_dir)
+            with patch(f'{MODULE_NAME}._GEO_INDEX_DIR', new=index_dir):
+                location_dict = _load_indexed_location_resources(os.path.join('cities', 'NL.pkl'))
+
+            trigrams = location_dict['trigrams']
+            for array in (trigrams['trigram_tokens'].indptr, trigrams['trigram_tokens'].indices, trigrams['n_tokens'],
+                          trigrams['size_offsets'], trigrams['trigram_postings'].indices,
+                          location_dict['levenshtein'][9]['char_matrix'].data):
+                self.assertFalse(array.flags.writeable)
+                self.assertEqual(array.ctypes.data % _GEO_INDEX_ALIGNMENT, 0)
+
+            expected_location_dict = _CITY_RESOURCES['cities_per_country_code_map']['NL']
+            for query in ('amsterdam', 'amsterdm', 'rotterdm', 'den hag', 'xyz'):
+                with self.subTest(query=query):
+                    self.assertEqual(find_closest_string(query, location_dict, 0.8, 0.5),
+                                     find_closest_string(query, expected_location_dict, 0.8, 0.5))
+
+    def test_index_not_used(self):
+        """
+        The index should not be used when it has a different version, or when IDs have already been handed out
+        """
+        with tempfile.TemporaryDirectory() as index_dir:
+            build_geo_index(set(), index_dir=index_dir)
+
+            for version, levenshtein_map, trigram_map in ((_GEO_INDEX_VERSION + 1, {}, {}),
+                                                          (_GEO_INDEX_VERSION, {'a': 0}, {}),
+                                                          (_GEO_INDEX_VERSION, {}, {'  a': 0})):
+                with self.subTest(version=version, levenshtein_map=levenshtein_map, trigram_map=trigram_map), \
+                        patch.object(string_distance_levenshtein, '_LEVENSHTEIN_MAP', new=levenshtein_map), \
+                        patch.object(string_distance_trigrams, '_TRIGRAM_MAP', new=trigram_map), \
+                        patch(f'{MODULE_NAME}._GEO_INDEX_VERSION', new=version), \
+                        patch(f'{MODULE_NAME}._GEO_INDEX_DIR', new=None):
+                    from text_scrubber.geo import resources
+                    _load_geo_index(index_dir)
+                    self.assertIsNone(resources._GEO_INDEX_DIR)
+                    self.assertIsNone(_load_indexed_location_resources('countries.pkl'))
+
+    def test_index_outdated(self):
+        """
+        The index should not be used, and a warning should be given, when it was built from other resource files
+        """
+        with tempfile.TemporaryDirectory() as index_dir:
+            build_geo_index(set(), index_dir=index_dir)
+
+            with patch.object(string_distance_levenshtein, '_LEVENSHTEIN_MAP', new={}), \
+                    patch.object(string_distance_trigrams, '_TRIGRAM_MAP', new={}), \
+                    patch(f'{MODULE_NAME}._get_resources_fingerprint', return_value='other'), \
+                    patch(f'{MODULE_NAME}._GEO_INDEX_DIR', new=None):
+                from text_scrubber.geo import resources
+                with self.assertWarns(UserWarning):
+                    _load_geo_index(index_dir)
+                self.assertIsNone(resources._GEO_INDEX_DIR)
+                self.assertIsNone(_load_indexed_location_resources('countries.pkl'))
+
+    def test_rebuild_while_in_use(self):
+        """
+        Rebuilding the index that is in use shouldn't alter the memory-mapped arrays that are already loaded. This is
+        run in a separate process, as accessing a truncated memory map crashes the interpreter
+        """
+        with tempfile.TemporaryDirectory() as index_dir:
+            build_geo_index({'NL'}, index_dir=index_dir)
+            code = ("from text_scrubber.geo import build_geo_index, normalize_city\n"
+                    "from text_scrubber.geo import resources\n"
+                    "assert resources._GEO_INDEX_DIR is not None\n"
+                    "expected = normalize_city('Amsterdm', {'NL'})\n"
+                    "build_geo_index({'NL'})\n"
+                    "assert normalize_city('Rotterdm', {'NL'})\n"
+                    "assert normalize_city('Amsterdm ', {'NL'}) == expected\n")
+            env = dict(os.environ, TEXT_SCRUBBER_GEO_INDEX_DIR=index_dir)
+            result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertListEqual(sorted(os.listdir(os.path.join(index_dir, 'cities'))), ['NL.pkl', 'NL.pkl.bin'])
+
+    def test_open_for_replace(self):
+        """
+        A file should only be replaced once it has been written completely. When something goes wrong, the temporary
+        file should be removed and the original error should be raised
+        """
+        with tempfile.TemporaryDirectory() as index_dir:
+            path = os.path.join(index_dir, 'file.pkl')
+            with _open_for_replace(path) as f:
+                f.write(b'old')
+
+            with self.assertRaises(ValueError), _open_for_replace(path) as f:
+                f.write(b'new')
+                raise ValueError
+            self.assertListEqual(os.listdir(index_dir), ['file.pkl'])
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'old')
+
+            # The temporary file can't be created in a directory that doesn't exist
+            with self.assertRaises(FileNotFoundError) as context, \
+                    _open_for_replace(os.path.join(index_dir, 'missing', 'file.pkl')):
+                pass
+            self.assertIsNone(context.exception.__context__)
+
+    def test_partial_rebuild(self):
+        """
+        Regions and cities stored previously should be removed when rebuilding an index that isn't in use, as their
+        Levenshtein and trigram IDs can differ from the new ones. They should be kept when the index is in use
+        """
+        with tempfile.TemporaryDirectory() as index_dir:
+            be_path = os.path.join(index_dir, 'cities', 'BE.pkl')
+            for geo_index_dir, expected_exists in ((None, False), (index_dir, True)):
+                with self.subTest(geo_index_dir=geo_index_dir), patch(f'{MODULE_NAME}._GEO_INDEX_DIR',
+                                                                      new=geo_index_dir):
+                    build_geo_index({'NL', 'BE'}, index_dir=index_dir)
+                    self.assertTrue(os.path.exists(be_path))
+                    build_geo_index({'NL'}, index_dir=index_dir)
+                    self.assertEqual(os.path.exists(be_path), expected_exists)
+                    self.assertEqual(os.path.exists(f'{be_path}.bin'), expected_exists)
+                    self.assertTrue(os.path.exists(os.path.join(index_dir, 'cities', 'NL.pkl')))
+                    self.assertTrue(os.path.exists(os.path.join(index_dir, 'vocabularies.pkl')))
+
+    def test_index_dir_env_var(self):
+        """
+        The index directory can be set using an environment variable. It's used both for building and loading
+        """
+        with tempfile.TemporaryDirectory() as index_dir:
+            with patch.dict(os.environ, {'TEXT_SCRUBBER_GEO_INDEX_DIR': index_dir}):
+                self.assertEqual(_get_geo_index_dir(), index_dir)
+                build_geo_index(set())
+            self.assertTrue(os.path.exists(os.path.join(index_dir, 'vocabularies.pkl')))
+
+        with patch.dict(os.environ, clear=True):
+            self.assertEqual(_get_geo_index_dir(), _DEFAULT_GEO_INDEX_DIR)
+
+    def test_no_index(self):
+        """
+        Nothing should be loaded when there's no index
+        """
+        with tempfile.TemporaryDirectory() as index_dir, \
+                patch(f'{MODULE_NAME}._GEO_INDEX_DIR', new=None):
+            from text_scrubber.geo import resources
+            _load_geo_index(index_dir)
+            self.assertIsNone(resources._GEO_INDEX_DIR)
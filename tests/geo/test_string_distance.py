@@ -1,9 +1,10 @@
+import re
 import unittest
 from unittest.mock import patch
 
 from scipy.sparse import csr_matrix
 
-from text_scrubber.geo.string_distance import find_closest_string
+from text_scrubber.geo.string_distance import find_closest_string, pattern_match
 
 
 class FindClosestStringTest(unittest.TestCase):
@@ -52,3 +53,18 @@ class FindClosestStringTest(unittest.TestCase):
             find_closest_string(self.query, self.candidates, 0.8, 0.5)
             self.assertEqual(p_levenshtein.call_count, 1)
             self.assertEqual(p_trigrams.call_count, 1)
+
+
+class PatternMatchTest(unittest.TestCase):
+
+    def test_pattern_match(self):
+        """
+        The replacement of the alternative that matches should be returned. When none of them match, it should return
+        None
+        """
+        pattern = re.compile(r'(?P<pattern_0>\d+ foo)|(?P<pattern_1>\d+ (foo|bar))', re.IGNORECASE)
+        replacements = {'pattern_0': 'foo', 'pattern_1': 'bar'}
+        for string, expected in (('123 foo', 'foo'), ('123 FOO bar', 'foo'), ('123 bar', 'bar'), ('foo 123', None),
+                                 ('', None)):
+            with self.subTest(string=string):
+                self.assertEqual(pattern_match(string, pattern, replacements), expected)
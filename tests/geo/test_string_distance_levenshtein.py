@@ -4,7 +4,7 @@ from unittest.mock import patch
 
 import numpy as np
 
-from text_scrubber.geo.string_distance_levenshtein import (get_char_overlap, get_char_tokens,
+from text_scrubber.geo.string_distance_levenshtein import (get_char_overlap, get_char_tokens, get_query_vector,
                                                            find_closest_string_levenshtein, find_levenshtein_bounds,
                                                            optimize_levenshtein_strings)
 
@@ -142,6 +142,20 @@ class GetCharTokensTest(unittest.TestCase):
             self.assertDictEqual(LEVENSHTEIN_MAP, {'h': 0, 'e': 1, 'l': 2, 'o': 3, ' ': 4, 'w': 5, 'r': 6, 'd': 7})
 
 
+class GetQueryVectorTest(unittest.TestCase):
+
+    def test_query_vector(self):
+        """
+        Tokens should be counted. Tokens that don't fit in the vector should be ignored
+        """
+        for query_tokens, n_chars, expected in [([0, 2, 2, 1, 2], 4, [1, 1, 3, 0]), ([0, 5, 3], 3, [1, 0, 0]),
+                                                ([], 2, [0, 0]), ([4], 0, [])]:
+            with self.subTest(query_tokens=query_tokens, n_chars=n_chars):
+                query_vector = get_query_vector(query_tokens, n_chars)
+                self.assertListEqual(query_vector.tolist(), expected)
+                self.assertEqual(query_vector.dtype, np.int32)
+
+
 class OptimizeLevenshteinStringsTest(unittest.TestCase):
 
     def test_char_matrix(self):
@@ -160,6 +174,21 @@ class OptimizeLevenshteinStringsTest(unittest.TestCase):
                                                                   [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
                                                                   [0, 0, 0, 0, 0, 0, 0, 5, 0, 0, 0]])
 
+    def test_same_as_char_tokens(self):
+        """
+        The character matrix should contain the same tokens as obtained using get_char_tokens, also for non-ASCII
+        characters and empty strings. New characters should be added to the map in order of first occurrence
+        """
+        strings = ["zürich", "", "北京", "🙂 zz", "rome"]
+        with patch(f'{MODULE_NAME}._LEVENSHTEIN_MAP', new={'r': 0}) as LEVENSHTEIN_MAP:
+            char_matrix = optimize_levenshtein_strings(strings)
+            self.assertListEqual(list(LEVENSHTEIN_MAP),
+                                 ['r', 'z', 'ü', 'i', 'c', 'h', '北', '京', '🙂', ' ', 'o', 'm', 'e'])
+            for row_idx, string in enumerate(strings):
+                with self.subTest(string=string):
+                    expected = np.bincount(get_char_tokens(string), minlength=len(LEVENSHTEIN_MAP)).tolist()
+                    self.assertListEqual(char_matrix[row_idx].todense().tolist()[0], expected)
+
 
 class FindLevenshteinBoundsTest(unittest.TestCase):
 
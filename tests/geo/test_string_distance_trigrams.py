@@ -3,8 +3,10 @@ from unittest.mock import patch
 
 import numpy as np
 
-from text_scrubber.geo.string_distance_trigrams import (get_trigram_tokens, find_closest_string_trigrams,
-                                                        find_trigram_bounds, optimize_trigram_tokens,
+from text_scrubber.geo.string_distance_trigrams import (get_posting_tokens, get_trigram_bitset, get_trigram_table,
+                                                        get_trigram_tokens, find_closest_string_trigrams,
+                                                        find_trigram_bounds,
+                                                        optimize_trigram_index, optimize_trigram_tokens,
                                                         trigram_similarity, trigram_similarity_naive)
 
 MODULE_NAME = 'text_scrubber.geo.string_distance_trigrams'
@@ -70,11 +72,53 @@ class FindClosestStringTrigramsTest(unittest.TestCase):
             self.assertListEqual(matches, [0, 1])
             self.assertAlmostEqual(match_score, 0.083, places=3)
 
+    def test_multiple_sizes(self):
+        """
+        Candidates of all sizes within bounds should be considered
+        """
+        with patch(f'{MODULE_NAME}._TRIGRAM_MAP', new={}):
+            candidate_trigram_tokens = [get_trigram_tokens(s) for s in ("hello", "hell", "helloo", "hallo", "hel")]
+            candidates = optimize_trigram_index(candidate_trigram_tokens, [0, 1, 2, 3, 4])
+            self.assertEqual(find_closest_string_trigrams("hell", candidates, min_score=0.5), ([1], 1.0))
+            self.assertEqual(find_closest_string_trigrams("helloo", candidates, min_score=0.5), ([2], 1.0))
+            matches, match_score = find_closest_string_trigrams("helo", candidates, min_score=0.3)
+            self.assertListEqual(matches, [0])
+            self.assertAlmostEqual(match_score, 0.625, places=3)
+
+    def test_postings(self):
+        """
+        When the minimum score is above 0.0 only candidates sharing a trigram with the query have to be considered. The
+        result should be the same as when considering all candidates
+        """
+        with patch(f'{MODULE_NAME}._TRIGRAM_MAP', new={}):
+            candidate_trigram_tokens = [get_trigram_tokens(s) for s in ("hello", "world", "help", "yellow", "halo")]
+            candidates = optimize_trigram_index(candidate_trigram_tokens, [0, 1, 2, 3, 4])
+            for query, min_score in (("hello", 0.8), ("helo", 0.2), ("helo", 0.6), ("yelow", 0.2), ("yelow", 0.5),
+                                     ("h d", 0.05), ("xyz", 0.1)):
+                with self.subTest(query=query, min_score=min_score), \
+                        patch(f'{MODULE_NAME}.get_posting_tokens', return_value=None):
+                    expected = find_closest_string_trigrams(query, candidates, min_score)
+                with self.subTest(query=query, min_score=min_score), \
+                        patch(f'{MODULE_NAME}.get_posting_tokens',
+                              side_effect=lambda *args: get_posting_tokens(*args[:-1], np.inf)):
+                    self.assertEqual(find_closest_string_trigrams(query, candidates, min_score), expected)
+
+    def test_query_bitset(self):
+        """
+        The query bitset should be created only once per query, sized to the number of trigrams in the candidates
+        """
+        with patch(f'{MODULE_NAME}._TRIGRAM_MAP', new={}):
+            candidates = self._create_data()
+            with patch(f'{MODULE_NAME}.get_trigram_bitset', side_effect=get_trigram_bitset) as p:
+                find_closest_string_trigrams("hello world", candidates, min_score=0.0)
+                self.assertEqual(p.call_count, 1)
+                self.assertEqual(p.call_args[0][1], 14)
+
     def test_no_candidates(self):
         """
         When there are candidates, it should return None
         """
-        matches = find_closest_string_trigrams("hello", {}, min_score=0.0)
+        matches = find_closest_string_trigrams("hello", optimize_trigram_index([], []), min_score=0.0)
         self.assertIsNone(matches)
 
     @staticmethod
@@ -83,23 +127,38 @@ class FindClosestStringTrigramsTest(unittest.TestCase):
         Normally, we would use setup method for this, but we need the patch
         """
         candidate_trigram_tokens = [get_trigram_tokens("hello"), get_trigram_tokens("world")]
-        trigram_matrix = optimize_trigram_tokens(candidate_trigram_tokens)
-        candidates = {len(candidate_trigram_tokens[0]): {'trigram_tokens': trigram_matrix,
-                                                         'indices': [0, 1]}}
-        return candidates
+        return optimize_trigram_index(candidate_trigram_tokens, [0, 1])
+
+
+class GetPostingTokensTest(unittest.TestCase):
+
+    def test_posting_tokens(self):
+        """
+        The rarest tokens should be used. Tokens that don't occur in the postings have empty postings, so they count as
+        the rarest. When the postings are empty, no tokens should be returned. When the postings get too large, None
+        should be returned
+        """
+        trigram_postings = optimize_trigram_tokens([{0, 1, 3}, {1, 4, 6}, {1, 5}, {4, 5}]).transpose().tocsr()
+        self.assertListEqual(sorted(get_posting_tokens({0, 1, 3, 4}, trigram_postings, 4, 8).tolist()), [0, 1, 3, 4])
+        self.assertListEqual(sorted(get_posting_tokens({0, 1, 3, 4}, trigram_postings, 3, 6).tolist()), [0, 3, 4])
+        self.assertListEqual(sorted(get_posting_tokens({0, 1, 3, 4}, trigram_postings, 2, 6).tolist()), [0, 3])
+        self.assertListEqual(sorted(get_posting_tokens({0, 4, 7, 8}, trigram_postings, 3, 6).tolist()), [0])
+        self.assertListEqual(get_posting_tokens({0, 4, 7, 8}, trigram_postings, 2, 6).tolist(), [])
+        self.assertListEqual(get_posting_tokens({0, 2, 4}, trigram_postings, 1, 6).tolist(), [])
+        self.assertIsNone(get_posting_tokens({0, 1, 3, 4}, trigram_postings, 4, 5))
+        self.assertIsNone(get_posting_tokens({1, 4}, trigram_postings, 1, 2))
 
 
 class TrigramSimilarityTest(unittest.TestCase):
 
     def test_out_of_bounds_tokens(self):
         """
-        The trigram_matrix does not contain the trigrams 7 and 8, so those should not be encoded in the query vector
+        The trigram_matrix does not contain the trigrams 7 and 8, so those can't be part of the query bitset. They
+        should, however, still count towards the number of query tokens
         """
         trigram_matrix = optimize_trigram_tokens([{0, 1, 3}, {1, 4, 6}])
-        with patch.object(trigram_matrix, 'dot', side_effect=trigram_matrix.dot) as p:
-            trigram_similarity(query_trigram_tokens={0, 1, 7, 8}, candidates_n_tokens=3, trigram_matrix=trigram_matrix)
-            query_vector = p.call_args[0][0]
-            self.assertListEqual(query_vector.tolist(), [1.0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+        query_bitset = get_trigram_bitset({0, 1, 7, 8}, trigram_matrix.shape[1])
+        self.assertListEqual(trigram_similarity(query_bitset, 4, 3, trigram_matrix).tolist(), [0.4, 1 / 6])
 
     def test_overlap(self):
         """
@@ -108,24 +167,62 @@ class TrigramSimilarityTest(unittest.TestCase):
         trigram_matrix = optimize_trigram_tokens([{0, 1, 3}, {1, 4, 6}])
 
         # Perfect/partial matches
-        self.assertEqual(trigram_similarity({0, 1, 3}, 3, trigram_matrix).tolist(), [1.0, 0.2])
-        self.assertEqual(trigram_similarity({1, 4, 6}, 3, trigram_matrix).tolist(), [0.2, 1.0])
+        self.assertEqual(self._trigram_similarity({0, 1, 3}, 3, trigram_matrix).tolist(), [1.0, 0.2])
+        self.assertEqual(self._trigram_similarity({1, 4, 6}, 3, trigram_matrix).tolist(), [0.2, 1.0])
 
         # Partial matches
-        self.assertAlmostEqual(trigram_similarity({0, 3}, 3, trigram_matrix)[0], 0.667, places=3)
-        self.assertEqual(trigram_similarity({0, 3}, 3, trigram_matrix)[1], 0.0)
-        self.assertEqual(trigram_similarity({0, 4, 6}, 3, trigram_matrix).tolist(), [0.2, 0.5])
+        self.assertAlmostEqual(self._trigram_similarity({0, 3}, 3, trigram_matrix)[0], 0.667, places=3)
+        self.assertEqual(self._trigram_similarity({0, 3}, 3, trigram_matrix)[1], 0.0)
+        self.assertEqual(self._trigram_similarity({0, 4, 6}, 3, trigram_matrix).tolist(), [0.2, 0.5])
 
         # No match
-        self.assertEqual(trigram_similarity({2, 5, 7, 8, 9, 10}, 3, trigram_matrix).tolist(), [0.0, 0.0])
-        self.assertEqual(trigram_similarity(set(), 3, trigram_matrix).tolist(), [0.0, 0.0])
+        self.assertEqual(self._trigram_similarity({2, 5, 7, 8, 9, 10}, 3, trigram_matrix).tolist(), [0.0, 0.0])
+        self.assertEqual(self._trigram_similarity(set(), 3, trigram_matrix).tolist(), [0.0, 0.0])
 
         # Altering candidates_n_tokens. Normally, they correspond to the size of the candidates, so changing it here
         # doesn't make any sense
-        self.assertAlmostEqual(trigram_similarity({0, 4, 6}, 1, trigram_matrix)[0], 0.333, places=3)
-        self.assertAlmostEqual(trigram_similarity({0, 4, 6}, 1, trigram_matrix)[1], 1.0, places=3)
-        self.assertAlmostEqual(trigram_similarity({0, 4, 6}, 5, trigram_matrix)[0], 0.143, places=3)
-        self.assertAlmostEqual(trigram_similarity({0, 4, 6}, 5, trigram_matrix)[1], 0.333, places=3)
+        self.assertAlmostEqual(self._trigram_similarity({0, 4, 6}, 1, trigram_matrix)[0], 0.333, places=3)
+        self.assertAlmostEqual(self._trigram_similarity({0, 4, 6}, 1, trigram_matrix)[1], 1.0, places=3)
+        self.assertAlmostEqual(self._trigram_similarity({0, 4, 6}, 5, trigram_matrix)[0], 0.143, places=3)
+        self.assertAlmostEqual(self._trigram_similarity({0, 4, 6}, 5, trigram_matrix)[1], 0.333, places=3)
+
+    def test_row_window(self):
+        """
+        Only the rows within the window should be compared against, each with their own number of trigram tokens
+        """
+        trigram_matrix = optimize_trigram_tokens([{0}, {0, 1, 3}, {1, 4, 6, 7}])
+        self.assertEqual(self._trigram_similarity({0, 1, 3}, np.array([1, 3, 4]), trigram_matrix).tolist(),
+                         [1 / 3, 1.0, 1 / 6])
+        self.assertEqual(self._trigram_similarity({0, 1, 3}, np.array([3, 4]), trigram_matrix, 1).tolist(),
+                         [1.0, 1 / 6])
+        self.assertEqual(self._trigram_similarity({0, 1, 3}, 3, trigram_matrix, 1, 2).tolist(), [1.0])
+
+    @staticmethod
+    def _trigram_similarity(query_trigram_tokens, candidates_n_tokens, trigram_matrix, *args):
+        """
+        Packs the query trigram tokens into a bitset before calling trigram_similarity
+        """
+        query_bitset = get_trigram_bitset(query_trigram_tokens, trigram_matrix.shape[1])
+        return trigram_similarity(query_bitset, len(query_trigram_tokens), candidates_n_tokens, trigram_matrix, *args)
+
+
+class GetTrigramBitsetTest(unittest.TestCase):
+
+    def test_get_trigram_bitset(self):
+        """
+        Test that the trigram tokens are correctly packed into 64-bit words
+        """
+        self.assertListEqual(get_trigram_bitset({0, 1, 3}, 7).tolist(), [0b1011])
+        self.assertListEqual(get_trigram_bitset({0, 63, 64, 130}, 131).tolist(), [1 | (1 << 63), 1, 1 << 2])
+        self.assertListEqual(get_trigram_bitset(set(), 65).tolist(), [0, 0])
+        self.assertListEqual(get_trigram_bitset({0, 1}, 0).tolist(), [])
+
+    def test_out_of_bounds_tokens(self):
+        """
+        Tokens that don't fit in the number of bits should be ignored
+        """
+        self.assertListEqual(get_trigram_bitset({0, 1, 7, 8}, 7).tolist(), [0b11])
+        self.assertListEqual(get_trigram_bitset({0, 64, 65}, 64).tolist(), [1])
 
 
 class TrigramSimilarityNaiveTest(unittest.TestCase):
@@ -179,6 +276,50 @@ class GetTrigramTokensTest(unittest.TestCase):
                                  {'  h': 0, ' he': 1, 'hel': 2, 'ell': 3, 'llo': 4, 'lo ': 5, 'o  ': 6,
                                   '  w': 7, ' wo': 8, 'wor': 9, 'orl': 10, 'rld': 11, 'ld ': 12, 'd  ': 13})
 
+    def test_other_characters(self):
+        """
+        Trigrams containing characters other than spaces and lowercase ASCII letters should be handled as well
+        """
+        with patch(f'{MODULE_NAME}._TRIGRAM_MAP', new={}) as TRIGRAM_MAP:
+            query_tokens = get_trigram_tokens("hé-h")
+            self.assertSetEqual(query_tokens, {0, 1, 2, 3, 4, 5})
+            self.assertDictEqual(TRIGRAM_MAP, {'  h': 0, ' hé': 1, 'hé-': 2, 'é-h': 3, '-h ': 4, 'h  ': 5})
+
+            query_tokens = get_trigram_tokens("hé")
+            self.assertSetEqual(query_tokens, {0, 1, 6, 7})
+            self.assertDictEqual(TRIGRAM_MAP, {'  h': 0, ' hé': 1, 'hé-': 2, 'é-h': 3, '-h ': 4, 'h  ': 5,
+                                               'hé ': 6, 'é  ': 7})
+
+    def test_existing_trigram_map(self):
+        """
+        Trigram IDs from an already filled trigram map should be used
+        """
+        with patch(f'{MODULE_NAME}._TRIGRAM_MAP', new={'  h': 10, ' hi': 11, 'hi ': 12, 'i  ': 13}) as TRIGRAM_MAP:
+            self.assertSetEqual(get_trigram_tokens("hi"), {10, 11, 12, 13})
+            self.assertSetEqual(get_trigram_tokens("ha"), {10, 4, 5, 6})
+            self.assertDictEqual(TRIGRAM_MAP, {'  h': 10, ' hi': 11, 'hi ': 12, 'i  ': 13, ' ha': 4, 'ha ': 5,
+                                               'a  ': 6})
+
+
+class GetTrigramTableTest(unittest.TestCase):
+
+    def test_get_trigram_table(self):
+        """
+        Trigrams consisting of only spaces and lowercase ASCII letters should be stored in the table using their base-27
+        encoding. Other trigrams should be ignored
+        """
+        trigram_table = get_trigram_table({'   ': 0, '  a': 1, 'ab ': 2, 'zzz': 3, 'Ab ': 4, 'é  ': 5, 'a-b': 6})
+        self.assertEqual(trigram_table.dtype, np.int32)
+        self.assertEqual(len(trigram_table), 27 ** 3)
+        self.assertDictEqual({idx: trigram_table[idx] for idx in np.flatnonzero(trigram_table >= 0)},
+                             {0: 0, 1: 1, (1 * 27 + 2) * 27: 2, 27 ** 3 - 1: 3})
+
+    def test_empty(self):
+        """
+        An empty trigram map should result in an empty table
+        """
+        self.assertTrue((get_trigram_table({}) == -1).all())
+
 
 class OptimizeTrigramTokensTest(unittest.TestCase):
 
@@ -195,6 +336,60 @@ class OptimizeTrigramTokensTest(unittest.TestCase):
                                                                  [0, 1, 0, 1, 0],
                                                                  [0, 0, 0, 0, 1]])
 
+    def test_n_tokens(self):
+        """
+        When the number of tokens is provided, it should be used for the row boundaries
+        """
+        trigram_matrix = optimize_trigram_tokens([{0, 1, 3}, {1, 4, 6}], np.array([3, 3], dtype=np.int32))
+        self.assertListEqual(trigram_matrix.indptr.tolist(), [0, 3, 6])
+        self.assertListEqual(trigram_matrix.todense().tolist(), [[1, 1, 0, 1, 0, 0, 0],
+                                                                 [0, 1, 0, 0, 1, 0, 1]])
+
+    def test_data_types(self):
+        """
+        The compiled similarity kernel expects 32-bit integers
+        """
+        trigram_matrix = optimize_trigram_tokens([{0, 1, 3}, {1, 4, 6}])
+        self.assertEqual(trigram_matrix.data.dtype, np.int32)
+        self.assertEqual(trigram_matrix.indptr.dtype, np.int32)
+        self.assertEqual(trigram_matrix.indices.dtype, np.int32)
+
+    def test_empty(self):
+        """
+        Without candidates the matrix should be empty
+        """
+        self.assertEqual(optimize_trigram_tokens([]).shape, (0, 0))
+
+
+class OptimizeTrigramIndexTest(unittest.TestCase):
+
+    def test_trigram_index(self):
+        """
+        Check that candidates are sorted by size and that the size offsets point to the first row of each size
+        """
+        trigram_index = optimize_trigram_index([{0, 1, 3}, {2}, {1, 4, 6, 7, 8}, {1, 3}, {5}], [0, 1, 2, 3, 4])
+        self.assertListEqual(trigram_index['trigram_tokens'].todense().tolist(),
+                             [[0, 0, 1, 0, 0, 0, 0, 0, 0],
+                              [0, 0, 0, 0, 0, 1, 0, 0, 0],
+                              [0, 1, 0, 1, 0, 0, 0, 0, 0],
+                              [1, 1, 0, 1, 0, 0, 0, 0, 0],
+                              [0, 1, 0, 0, 1, 0, 1, 1, 1]])
+        self.assertListEqual(trigram_index['indices'], [1, 4, 3, 0, 2])
+        self.assertListEqual(trigram_index['n_tokens'].tolist(), [1, 1, 2, 3, 5])
+        self.assertListEqual(trigram_index['size_offsets'].tolist(), [0, 0, 2, 3, 4, 4, 5])
+        self.assertListEqual(trigram_index['trigram_postings'].todense().tolist(),
+                             trigram_index['trigram_tokens'].todense().T.tolist())
+
+    def test_empty(self):
+        """
+        An index without candidates should be empty
+        """
+        trigram_index = optimize_trigram_index([], [])
+        self.assertEqual(trigram_index['trigram_tokens'].shape, (0, 0))
+        self.assertListEqual(trigram_index['indices'], [])
+        self.assertListEqual(trigram_index['n_tokens'].tolist(), [])
+        self.assertListEqual(trigram_index['size_offsets'].tolist(), [0])
+
 
 class FindTrigramBoundsTest(unittest.TestCase):
 
@@ -1,7 +1,11 @@
 import types
 import unittest
+from unittest.mock import patch
+
+from anyascii import anyascii
 
 from text_scrubber import TextScrubber
+from text_scrubber.text_scrubber import PARALLEL_MIN_TEXTS, RE2_AVAILABLE
 
 
 class TextScrubberTest(unittest.TestCase):
@@ -44,12 +48,71 @@ class TextScrubberTest(unittest.TestCase):
         self.assertEqual(sc.transform([['hello', 'world'], ['slimmer', 'AI']], on_tokens=True, to_set=False),
                          'helloslimmer')
 
+    def test_transform_parallel(self):
+        # The pipeline contains a lambda, which can't be pickled. Results should be the same as without workers
+        sc = TextScrubber().tokenize().token_transform(lambda t: t.upper()).initials().join('')
+        texts = [f'hello world {idx}' for idx in range(PARALLEL_MIN_TEXTS)]
+        self.assertEqual(sc.transform(texts, n_jobs=2), sc.transform(texts))
+        self.assertEqual(sc.transform(iter(texts), n_jobs=2, to_set=True), {'HW0', 'HW1', 'HW2', 'HW3', 'HW4', 'HW5',
+                                                                            'HW6', 'HW7', 'HW8', 'HW9'})
+
+        # Too few texts to use workers
+        self.assertEqual(sc.transform(iter(['hello world', 'slimmer AI']), n_jobs=2), ['HW', 'SA'])
+
+    def test_transform_n_jobs(self):
+        # A negative number of jobs uses all CPUs, 0 jobs isn't allowed
+        sc = TextScrubber().lowercase()
+        texts = [f'Hello World {idx}' for idx in range(PARALLEL_MIN_TEXTS)]
+        with patch('text_scrubber.text_scrubber.os.cpu_count', return_value=3), \
+                patch.object(TextScrubber, '_transform_parallel', return_value=['parallel']) as transform_parallel:
+            self.assertEqual(sc.transform(texts, n_jobs=-1), ['parallel'])
+            self.assertEqual(transform_parallel.call_args[0][1], 3)
+            self.assertEqual(sc.transform(texts, n_jobs=-2), ['parallel'])
+            self.assertEqual(transform_parallel.call_args[0][1], 3)
+        self.assertEqual(sc.transform(texts, n_jobs=-1), [text.lower() for text in texts])
+        with self.assertRaises(ValueError):
+            sc.transform(texts, n_jobs=0)
+        with self.assertRaises(ValueError):
+            sc.transform('Hello', n_jobs=0)
+
+    def test_transform_parallel_not_linux(self):
+        # Other platforms don't fork, so the pipeline has to be pickled. When that's not possible, it should warn and
+        # transform without workers
+        texts = [f'Hello World {idx}' for idx in range(PARALLEL_MIN_TEXTS)]
+        with patch('text_scrubber.text_scrubber.sys.platform', new='darwin'):
+            sc = TextScrubber().tokenize().token_transform(lambda t: t.upper()).initials().join('')
+            with self.assertWarns(UserWarning):
+                self.assertEqual(sc.transform(texts, n_jobs=2), sc.transform(texts))
+
+            sc = TextScrubber().lowercase().strip()
+            self.assertEqual(sc.transform(texts, n_jobs=2), [text.lower() for text in texts])
+
     def test_transform_generator(self):
         sc = (TextScrubber().tokenize().initials().join(''))
         gen = sc.transform_generator(['hello world', 'slimmer AI'])
         self.assertTrue(isinstance(gen, types.GeneratorType))
         self.assertEqual(list(gen), ['hw', 'sA'])
 
+    def test_fused_steps(self):
+        # Adjacent steps removing characters are fused into a single step, but all steps should still be listed
+        sc = TextScrubber().remove_digits().remove_punctuation(keep_punctuation='-').remove_quotes().lowercase()
+        self.assertEqual(str(sc), 'text_scrubber.text_scrubber(remove_digits_0 -> remove_punctuation_1 -> '
+                                  'strip_quotes_2 -> lowercase_3)')
+        self.assertEqual(len(sc._fused_steps), 2)
+        self.assertEqual(sc.transform(['Hello, "world" 42!', 'slimmer-AI\'s', 'héllo, wörld²']),
+                         ['hello world ', 'slimmer-ais', 'héllo wörld'])
+
+        # Characters to keep cached by the lazy digits table shouldn't overwrite removals of other steps
+        self.assertEqual(TextScrubber().remove_digits().transform('hé, wörld²!'), 'hé, wörld!')
+        sc = TextScrubber().remove_punctuation().remove_digits()
+        self.assertEqual(sc.transform('hé, wörld²!'), 'hé wörld')
+
+        # Steps on texts and steps on tokens aren't fused
+        sc = (TextScrubber().remove_digits().tokenize().remove_punctuation(on_tokens=True).remove_quotes(on_tokens=True)
+                            .join())
+        self.assertEqual(len(sc._fused_steps), 4)
+        self.assertEqual(sc.transform('hello, "world" 42!'), 'hello world ')
+
     def test_convert_html_entities(self):
         sc = TextScrubber().convert_html_entities()
         inputs = ['No HTML here', '©', '&#x20;', '&#10;', 'Hello&nbsp;World',
@@ -170,12 +233,20 @@ class TextScrubberTest(unittest.TestCase):
         self.assertEqual(sc.transform(['hello 1337 world', 'Atoomweg 6b']),
                          ['hello duizenddriehonderdzevenendertig world', 'Atoomweg zes b'])
 
+        # Results are cached per language and comma setting. Check that a cached result doesn't leak into another
+        # setting
+        sc = TextScrubber().num2words(include_commas=True, language='en', on_tokens=False)
+        self.assertEqual(sc.transform('1337'), 'one thousand, three hundred and thirty-seven')
+
     def test_remove_digits(self):
         # On entire strings
         sc = TextScrubber().remove_digits(on_tokens=False)
         self.assertEqual(sc.transform('hell0 world12'), 'hell world')
         self.assertEqual(sc.transform(['hell0 world12', 'sl1mm3r A1']), ['hell world', 'slmmr A'])
 
+        # Non-ASCII texts and digits
+        self.assertEqual(sc.transform(['hé1lo wörld²', 'x٣y４z']), ['hélo wörld', 'xyz'])
+
         # On tokens. We use a to_list() here such that we don't receive a generator
         sc = TextScrubber().remove_digits(on_tokens=True).to_list()
         self.assertEqual(sc.transform(['hell0 world12'], on_tokens=True), ['hell world'])
@@ -198,6 +269,10 @@ class TextScrubberTest(unittest.TestCase):
         self.assertEqual(sc.transform(['hello <i>world</i></br>', '<a tag>slimmer</some tag><sup>AI</sup>']),
                          ['hello world', 'slimmerAI'])
 
+        # Texts without tags, unclosed tags, and tags spanning multiple lines are left as is
+        self.assertEqual(sc.transform(['hello world', 'hello > world', 'hello < world', '<hello\nworld>']),
+                         ['hello world', 'hello > world', 'hello < world', '<hello\nworld>'])
+
         # On tokens. We use a to_list() here such that we don't receive a generator
         sc = TextScrubber().remove_html_tags(on_tokens=True).to_list()
         self.assertEqual(sc.transform(['<b>hello</b> wo<FOO>rld'], on_tokens=True), ['hello world'])
@@ -215,11 +290,16 @@ class TextScrubberTest(unittest.TestCase):
         self.assertEqual(sc.transform(['fooBar fooBar'], on_tokens=True), ['Bar fooBar'])
         self.assertEqual(sc.transform([['hello world', 'world hello']]), [['hello world', ' hello']])
 
+        # Prefixes are regular expressions
+        sc = TextScrubber().removes_prefixes({'fo+', r'w\w'}, on_tokens=False)
+        self.assertEqual(sc.transform(['foooBar', 'world hello', 'hello']), ['Bar', 'rld hello', 'hello'])
+
     def test_remove_punctuation(self):
         # On entire strings
         sc = TextScrubber().remove_punctuation(keep_punctuation='', on_tokens=False)
         self.assertEqual(sc.transform('hello, world!'), 'hello world')
         self.assertEqual(sc.transform(['hello, world!', 'slimmer-slimst.Ai']), ['hello world', 'slimmerslimstAi'])
+        self.assertEqual(sc.transform('héllo, wörld!'), 'héllo wörld')
 
         # On tokens. We use a to_list() here such that we don't receive a generator
         sc = TextScrubber().remove_punctuation(keep_punctuation='', on_tokens=True).to_list()
@@ -230,12 +310,14 @@ class TextScrubberTest(unittest.TestCase):
         sc = TextScrubber().remove_punctuation(keep_punctuation=',.', on_tokens=False)
         self.assertEqual(sc.transform('hello, world!'), 'hello, world')
         self.assertEqual(sc.transform(['hello, world!', 'slimmer-slimst.Ai']), ['hello, world', 'slimmerslimst.Ai'])
+        self.assertEqual(sc.transform('héllo, wörld!'), 'héllo, wörld')
 
     def test_remove_quotes(self):
         # On entire strings
         sc = TextScrubber().remove_quotes(on_tokens=False)
         self.assertEqual(sc.transform('"hello world"'), 'hello world')
         self.assertEqual(sc.transform(['"hello world"', 'slimmer\' AI']), ['hello world', 'slimmer AI'])
+        self.assertEqual(sc.transform('"héllo wörld"'), 'héllo wörld')
 
         # On tokens. We use a to_list() here such that we don't receive a generator
         sc = TextScrubber().remove_quotes(on_tokens=True).to_list()
@@ -272,6 +354,14 @@ class TextScrubberTest(unittest.TestCase):
         self.assertEqual(sc.transform(['fooBar fooBar'], on_tokens=True), ['fooBar foo'])
         self.assertEqual(sc.transform([['hello world', 'world hello']]), [['hello ', 'world hello']])
 
+        # The longest suffix is removed. Like with a regex, a trailing newline is kept
+        sc = TextScrubber().remove_suffixes({'ing', 'ring'}, on_tokens=False)
+        self.assertEqual(sc.transform(['string', 'string\n', 'strings', '']), ['st', 'st\n', 'strings', ''])
+
+        # Suffixes are regular expressions
+        sc = TextScrubber().remove_suffixes({'o+', r'\d'}, on_tokens=False)
+        self.assertEqual(sc.transform(['foo', 'bar1', 'bar']), ['f', 'bar', 'bar'])
+
     def test_sort(self):
         # Default setting. We use a to_list() here such that we don't receive a generator
         sc = TextScrubber().sort(reverse=False).to_list()
@@ -326,6 +416,22 @@ class TextScrubberTest(unittest.TestCase):
         self.assertEqual(sc.transform(['i', 'am', 'phd.', 'student.'], on_tokens=True), ['i', 'am', 'phd', 'student.'])
         self.assertEqual(sc.transform([['i', 'am', 'phd.', 'student.']]), [['i', 'am', 'phd', 'student.']])
 
+    @unittest.skipUnless(RE2_AVAILABLE, 'google-re2 is not installed')
+    def test_sub_re2(self):
+        # Results should be the same as with the re engine
+        for search, replace in [(r'ph\.?\ ?d\.?', 'PhD'), (r'(\w+)@(\w+)', r'\2 at \1'),
+                                (r'(?<=a)b', 'c')]:
+            with self.subTest(search=search):
+                sc_re = TextScrubber().sub(search, replace)
+                sc_re2 = TextScrubber().sub(search, replace, use_re2=True)
+                texts = ['Ph.D. ph d phd', 'hello@world', 'abab', '']
+                self.assertEqual(sc_re2.transform(texts), sc_re.transform(texts))
+
+    @unittest.skipIf(RE2_AVAILABLE, 'google-re2 is installed')
+    def test_sub_re2_not_available(self):
+        with self.assertRaises(ImportError):
+            TextScrubber().sub('a', 'b', use_re2=True)
+
     def test_sub_greek_chars(self):
         # On entire string.
         sc = TextScrubber().sub_greek_chars()
@@ -342,6 +448,7 @@ class TextScrubberTest(unittest.TestCase):
         self.assertEqual(sc.transform('Marco P&#246;chacker'), 'Marco Pöchacker')
         self.assertEqual(sc.transform('&#64; My Place'), '@ My Place')
         self.assertEqual(sc.transform('Carl&#39;s'), 'Carl\'s')
+        self.assertEqual(sc.transform('Tom & Jerry #1'), 'Tom & Jerry #1')
 
         # On tokens. We use a to_list() here such that we don't receive a generator
         sc = TextScrubber().sub_html_chars(on_tokens=True).to_list()
@@ -352,6 +459,7 @@ class TextScrubberTest(unittest.TestCase):
         sc = TextScrubber().sub_latex_chars()
         self.assertEqual(sc.transform(r'Eric \"Ozg\"ur Sar{\i}o\u{g}lu'), 'Eric Ozgur Sarioglu')
         self.assertEqual(sc.transform(r'Jan K\v{r}et\'insk\'y'), 'Jan Kretinsky')
+        self.assertEqual(sc.transform('Jan {Kretinsky}'), 'Jan {Kretinsky}')
 
         # On tokens. We use a to_list() here such that we don't receive a generator
         sc = TextScrubber().sub_latex_chars(on_tokens=True).to_list()
@@ -375,6 +483,12 @@ class TextScrubberTest(unittest.TestCase):
         self.assertEqual(sc.transform(['héllô wòrld'], on_tokens=True), ['hello world'])
         self.assertEqual(sc.transform([['héllô wòrld', 'slímm̀er ÀI']]), [['hello world', 'slimmer AI']])
 
+        # Results should be the same as when using anyascii directly
+        sc = TextScrubber().to_ascii(on_tokens=False)
+        for text in ['Straße Ærø', 'Σωκράτης', '北京市', 'Київ', '½ × 3 ≥ 1 🙂', '']:
+            with self.subTest(text=text):
+                self.assertEqual(sc.transform(text), anyascii(text))
+
     def test_to_list(self):
         # The map objects will be materialized by the to_list() function
         sc = TextScrubber().to_list()
@@ -1,6 +1,10 @@
+from functools import lru_cache
 from typing import List, Union
 
-from text_scrubber import TextScrubber
+from text_scrubber.geo.clean_c import clean_geo_string
+
+# Maximum number of single strings for which the cleaned result is cached
+_CLEAN_CACHE_SIZE = 65536
 
 # Some common token replacements
 _GEO_TOKEN_MAP = {'afr': 'african',
@@ -26,19 +30,10 @@ _GEO_TOKEN_MAP = {'afr': 'african',
                   'ter': 'territory',
                   'territories': 'territory'}
 
-# We define the scrubber once so the regex objects will be compiled only once
-_GEO_STRING_SCRUBBER = (TextScrubber().to_ascii()
-                                      .remove_digits()
-                                      .sub(r'-|/|&|,', ' ')
-                                      .remove_punctuation()
-                                      .tokenize()
-                                      .remove_stop_words({'a', 'an', 'and', 'der', 'da', 'di', 'do', 'e', 'le', 'im',
-                                                          'mail'}, case_sensitive=True)
-                                      .lowercase(on_tokens=True)
-                                      .filter_tokens()
-                                      .sub_tokens(lambda token: _GEO_TOKEN_MAP.get(token, token))
-                                      .remove_stop_words({'cedex', 'email', 'of', 'the'})
-                                      .join())
+# Stop words. The first set is removed before lowercasing and is case-sensitive, such that abbreviations like 'A' and
+# 'DO' are kept. The second set is removed after lowercasing and replacing common tokens
+_GEO_STOP_WORDS_CASE_SENSITIVE = frozenset({'a', 'an', 'and', 'der', 'da', 'di', 'do', 'e', 'le', 'im', 'mail'})
+_GEO_STOP_WORDS = frozenset({'cedex', 'email', 'of', 'the'})
 
 
 def _clean_geo_string(string: Union[str, List[str]]) -> Union[str, List[str]]:
@@ -48,7 +43,35 @@ def _clean_geo_string(string: Union[str, List[str]]) -> Union[str, List[str]]:
     :param string: Input string to clean.
     :return: Cleaned string.
     """
-    return _GEO_STRING_SCRUBBER.transform(string)
+    if isinstance(string, str):
+        return _clean_geo_string_cached(string)
+    return [_clean_single_geo_string(single_string) for single_string in string]
+
+
+@lru_cache(maxsize=_CLEAN_CACHE_SIZE)
+def _clean_geo_string_cached(string: str) -> str:
+    """
+    Cleans a single string with geographical information. Results are cached, as the same strings are cleaned over and
+    over again (e.g., when normalizing after checking a blacklist in ``find_country_in_string``).
+
+    :param string: Input string to clean.
+    :return: Cleaned string.
+    """
+    return _clean_single_geo_string(string)
+
+
+def _clean_single_geo_string(string: str) -> str:
+    """
+    Cleans a single string with geographical information. Converts it to ASCII, removes digits and punctuation, splits
+    it in tokens, removes stop words, lowercases, and replaces common tokens.
+
+    All steps are done in a single pass over the characters in Cython, which saves the overhead of going through each
+    step separately.
+
+    :param string: Input string to clean.
+    :return: Cleaned string.
+    """
+    return clean_geo_string(string, _GEO_STOP_WORDS_CASE_SENSITIVE, _GEO_TOKEN_MAP, _GEO_STOP_WORDS)
 
 
 # Same cleaning is used for countries, regions, and cities
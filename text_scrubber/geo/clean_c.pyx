@@ -0,0 +1,86 @@
+# cython: language_level=3
+
+import cython
+from cpython.unicode cimport PyUnicode_DecodeASCII
+from libc.stdlib cimport free, malloc
+
+from text_scrubber.text_scrubber import TRANSLATION_TABLE_TO_ASCII
+
+# Character classes of ASCII characters: digits and punctuation are removed, whitespace and some punctuation separate
+# tokens, and all other characters are part of a token
+cdef enum CharClass:
+    KEEP = 0
+    REMOVE = 1
+    SEPARATE = 2
+
+cdef CharClass CHAR_CLASSES[128]
+for _char_idx in range(128):
+    _char = chr(_char_idx)
+    if _char.isspace() or _char in '-/&,':
+        CHAR_CLASSES[_char_idx] = SEPARATE
+    elif _char.isdigit() or (_char.isprintable() and not _char.isalnum()):
+        CHAR_CLASSES[_char_idx] = REMOVE
+    else:
+        CHAR_CLASSES[_char_idx] = KEEP
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def clean_geo_string(str string, frozenset stop_words_case_sensitive, dict token_map,
+                     frozenset stop_words) -> str:
+    """
+    Cleans a single string with geographical information. Converts it to ASCII, removes digits and punctuation, splits
+    it in tokens, removes stop words, lowercases, and replaces common tokens.
+
+    :param string: Input string to clean.
+    :param stop_words_case_sensitive: stop words to remove before lowercasing
+    :param token_map: dictionary of token replacements, applied after lowercasing
+    :param stop_words: stop words to remove after replacing tokens
+    :return: Cleaned string.
+    """
+    # Transliterate to plain 7-bit ASCII using anyascii
+    if not string.isascii():
+        string = string.translate(TRANSLATION_TABLE_TO_ASCII)
+
+    # Tokens are gathered in two buffers, one with the original characters and one with the lowercased characters
+    cdef Py_ssize_t n_chars = len(string), char_idx, token_size = 0
+    cdef Py_UCS4 char
+    cdef int char_code
+    cdef CharClass char_class
+    cdef char *token_buffer = <char *> malloc(n_chars + 1)
+    cdef char *token_lower_buffer = <char *> malloc(n_chars + 1)
+    if token_buffer == NULL or token_lower_buffer == NULL:
+        free(token_buffer)
+        free(token_lower_buffer)
+        raise MemoryError()
+
+    cdef list tokens = []
+    try:
+        for char_idx in range(n_chars + 1):
+            # A virtual separator at the end makes sure the last token is processed as well
+            if char_idx < n_chars:
+                char = string[char_idx]
+                char_code = char
+                # The string is ASCII after transliterating, but we don't want to rely on that for the table lookup
+                char_class = CHAR_CLASSES[char_code] if char_code < 128 else REMOVE
+                if char_class == KEEP:
+                    token_buffer[token_size] = <char> char_code
+                    token_lower_buffer[token_size] = <char> (char_code + 32 if 65 <= char_code <= 90 else char_code)
+                    token_size += 1
+                    continue
+                elif char_class == REMOVE:
+                    continue
+
+            if token_size:
+                token = PyUnicode_DecodeASCII(token_buffer, token_size, NULL)
+                if token not in stop_words_case_sensitive:
+                    token = PyUnicode_DecodeASCII(token_lower_buffer, token_size, NULL)
+                    token = token_map.get(token, token)
+                    if token not in stop_words:
+                        tokens.append(token)
+                token_size = 0
+    finally:
+        free(token_buffer)
+        free(token_lower_buffer)
+
+    return ' '.join(tokens)
@@ -1,7 +1,10 @@
 import inspect
+import re
+from bisect import bisect_right
 from dataclasses import dataclass
+from functools import lru_cache
 from itertools import product
-from typing import Callable, Iterable, List, Optional, Set
+from typing import Callable, FrozenSet, List, Optional, Set, Tuple
 
 from text_scrubber.geo.clean import clean_city, clean_country, clean_region
 from text_scrubber.geo.normalize import Location, normalize_city, normalize_country, normalize_region
@@ -9,6 +12,23 @@ from text_scrubber.geo.resources import _COUNTRY_RESOURCES
 from text_scrubber.geo.string_distance_levenshtein import find_levenshtein_bounds
 from text_scrubber.geo.string_distance_trigrams import find_trigram_bounds
 
+# Tokens are separated by whitespace
+RE_TOKEN = re.compile(r'\S+')
+
+# We skip certain tokens when looking for countries, as they are too confusing. The whitelist_last_resort is used for
+# when no countries could be found. In that case we do allow to find those strings, if they're uppercase. Country codes
+# don't change after loading the resources, so these are determined only once
+_COUNTRY_BLACKLIST = frozenset(_COUNTRY_RESOURCES['all_country_codes'] |
+                               {cc.lower() for cc in _COUNTRY_RESOURCES['all_country_codes']} | {'u'})
+_COUNTRY_WHITELIST_LAST_RESORT = frozenset(_COUNTRY_RESOURCES['all_country_codes'])
+
+# Cities and regions aren't confusing enough to skip any tokens
+_NO_BLACKLIST = _NO_WHITELIST_LAST_RESORT = frozenset()
+
+# Maximum number of samples for which the extracted locations are cached. The same samples (e.g., affiliations or
+# addresses) tend to occur over and over again in real data sets
+_FIND_IN_STRING_CACHE_SIZE = 16384
+
 
 @dataclass(init=True, frozen=True)
 class Range:
@@ -36,22 +56,6 @@ def range_has_overlap(range_1: Optional[Range], range_2: Optional[Range]) -> boo
     return max(range_1.start, range_2.start) < min(range_1.end, range_2.end)
 
 
-def cumsum(x: Iterable) -> List:
-    """
-    Replicates numpy.cumsum
-
-    :param x: List of numbers
-    :return: List of cumulative sums
-    """
-    y = []
-    summed = 0
-    for e in x:
-        summed += e
-        y.append(summed)
-
-    return y
-
-
 def _find_in_string(sample: str, clean_func: Callable, normalize_func: Callable, blacklist: Set,
                     whitelist_last_resort: Set, match_threshold: float = 0.84, match_threshold_small: float = 0.90,
                     threshold_small: int = 4, max_tokens_to_consider: int = 4,
@@ -89,108 +93,109 @@ def _find_in_string(sample: str, clean_func: Callable, normalize_func: Callable,
     :return: list of possible matches
     """
     # First goes through combinations of 1-max_tokens tokens and applies the normalization function of text_scrubber.geo
-    # to check if a candidate is present. We store the start and end idx
-    tokens = sample.split()
-    token_start_idx = [0] + cumsum((len(token) for token in tokens))
+    # to check if a candidate is present. We store the start and end idx. Combinations are taken as slices of the
+    # sample, so we only need the token boundaries
+    token_spans = [match.span() for match in RE_TOKEN.finditer(sample)]
     matches = []
     for n_tokens in range(1, max_tokens_to_consider):
-        for start_idx in range(0, len(tokens) + 1 - n_tokens):
-            combination = ' '.join(tokens[start_idx:start_idx + n_tokens]).rstrip(' .,-()')
+        for start_idx in range(0, len(token_spans) + 1 - n_tokens):
+            str_start_idx = token_spans[start_idx][0]
+            combination = sample[str_start_idx:token_spans[start_idx + n_tokens - 1][1]].rstrip(' .,-()')
 
-            # Skip blacklisted combinations
-            if combination in blacklist or clean_func(combination) in blacklist:
+            # Nothing can be found when only punctuation was left (e.g., a lone '-')
+            if not combination:
+                continue
+
+            # Skip blacklisted combinations. Cities and regions don't have a blacklist, so we don't need to clean there
+            if blacklist and (combination in blacklist or clean_func(combination) in blacklist):
                 continue
 
             # Look for a match
-            match = _get_matches(combination, token_start_idx, start_idx, normalize_func, match_threshold,
-                                 match_threshold_small, threshold_small, restrict_countries)
+            match = _get_matches(combination, str_start_idx, normalize_func, match_threshold, match_threshold_small,
+                                 threshold_small, restrict_countries)
             if match is not None:
                 matches.append(match)
 
     # Do the above again, but now without blacklist and only one token
     # the second condition is for speeding up. Since if the blacklist is empty, it doesn't make sense to check the rest
     if not matches and bool(len(blacklist)):
-        n_tokens = 1
-        for start_idx in range(0, len(tokens) + 1 - n_tokens):
-            combination = ' '.join(tokens[start_idx:start_idx + n_tokens]).rstrip(' .,-()')
+        for str_start_idx, str_end_idx in token_spans:
+            combination = sample[str_start_idx:str_end_idx].rstrip(' .,-()')
 
             # Skip non-whitelisted combinations. We assume they're valid candidates now
             if combination not in whitelist_last_resort:
                 continue
 
             # Look for a match
-            match = _get_matches(combination, token_start_idx, start_idx, normalize_func, match_threshold,
-                                 match_threshold_small, threshold_small, restrict_countries)
+            match = _get_matches(combination, str_start_idx, normalize_func, match_threshold, match_threshold_small,
+                                 threshold_small, restrict_countries)
             if match is not None:
                 matches.append(match)
 
     # Sort desc by score
     matches = sorted(matches, key=lambda c: -c.location.score)
 
-    # Determine which matches to keep and which ones to dismiss when there's overlap in substrings.
-    # The values in this array are as follows: 0=completely dismissed, 1=uncertain, 2=accepted
-    keep_matches = [1 for _ in range(len(matches))]
-    while any(match == 1 for match in keep_matches):
+    # Determine which matches to keep and which ones to dismiss when there's overlap in substrings. If there's overlap
+    # between results, we take the one with the highest score. If scores are equal, we take the longest normalized one
+    # (e.g., 'Guinea' vs 'Papua New Guinea'). If that's also equal, then we take the smallest original string that lead
+    # to it (e.g., 'New York 1234' vs 'New York'). We go through the matches from best to worst and keep a match when it
+    # doesn't overlap with any of the matches kept so far. The kept ranges never overlap, so they're sorted by both
+    # start and end idx and we only have to check the kept neighbours of a range, which we find by bisection
+    order = sorted(range(len(matches)), key=lambda idx: _dominance_key(matches[idx]))
+    keep_matches = [False] * len(matches)
+    kept_starts, kept_ends = [], []
+    for idx in order:
+        substring_range = matches[idx].substring_range
+        insert_idx = bisect_right(kept_starts, substring_range.start)
+        if insert_idx and kept_ends[insert_idx - 1] > substring_range.start:
+            continue
+        if insert_idx < len(kept_starts) and kept_starts[insert_idx] < substring_range.end:
+            continue
+        kept_starts.insert(insert_idx, substring_range.start)
+        kept_ends.insert(insert_idx, substring_range.end)
+        keep_matches[idx] = True
 
-        prev = [k for k in keep_matches]
-        for idx_1, match_1 in enumerate(matches):
+    # Filter
+    return [match for match, keep_match in zip(matches, keep_matches) if keep_match]
 
-            # Already accepted/dismissed?
-            if keep_matches[idx_1] in {0, 2}:
-                continue
 
-            # Check if it has no overlap to any following candidate that hasn't yet been dimissed entirely. If there's
-            # overlap between results, we take the one with the highest score. If scores are equal, we take the longest
-            # normalized one (e.g., 'Guinea' vs 'Papua New Guinea'). If that's also equal, then we take the smallest
-            # original string that lead to it (e.g., 'New York 1234' vs 'New York').
-            skip_match = False
-            for idx_2, match_2 in enumerate(matches[idx_1 + 1:], start=idx_1 + 1):
-                if keep_matches[idx_2] != 0 and range_has_overlap(match_1.substring_range, match_2.substring_range):
-                    if match_1.location.score > match_2.location.score:
-                        continue
-                    elif match_1.location.score < match_2.location.score:
-                        skip_match = True
-                        break
-
-                    if len(match_1.location.canonical_name) > len(match_2.location.canonical_name):
-                        continue
-                    elif len(match_1.location.canonical_name) < len(match_2.location.canonical_name):
-                        skip_match = True
-                        break
-
-                    if len(match_1.substring) < len(match_2.substring):
-                        continue
-                    elif len(match_1.substring) > len(match_2.substring):
-                        skip_match = True
-                        break
-
-            # If we keep this one, disable others that have overlap
-            if not skip_match:
-                keep_matches[idx_1] = 2
-                for idx_2, match_2 in enumerate(matches):
-                    if idx_1 != idx_2 and range_has_overlap(match_1.substring_range, match_2.substring_range):
-                        keep_matches[idx_2] = 0
-
-        # Fail-safe to avoid infinite loops. I don't expect there to be any, but just to be safe
-        if prev == keep_matches:
-            break
+def _dominance_key(match: ExtractedLocation) -> Tuple[float, int, int]:
+    """
+    Sorting key for resolving overlap between matches. A match with a smaller key is preferred: a higher score first,
+    then a longer normalized name, and then a shorter original string.
 
-    # Filter
-    return [c for idx, c in enumerate(matches) if keep_matches[idx] == 2]
+    :param match: ExtractedLocation object
+    :return: tuple to compare matches by
+    """
+    return -match.location.score, -len(match.location.canonical_name), len(match.substring)
+
+
+@lru_cache(maxsize=_FIND_IN_STRING_CACHE_SIZE)
+def _find_in_string_cached(sample: str, clean_func: Callable, normalize_func: Callable, blacklist: FrozenSet,
+                           whitelist_last_resort: FrozenSet, match_threshold: float, match_threshold_small: float,
+                           threshold_small: int, max_tokens_to_consider: int,
+                           restrict_countries: Optional[FrozenSet]) -> Tuple[ExtractedLocation, ...]:
+    """
+    Cached version of ``_find_in_string``. All arguments need to be hashable. The results are returned as a tuple, such
+    that the cached results can't be altered. See ``_find_in_string`` for the parameters.
+
+    :return: tuple of possible matches
+    """
+    return tuple(_find_in_string(sample, clean_func, normalize_func, blacklist, whitelist_last_resort, match_threshold,
+                                 match_threshold_small, threshold_small, max_tokens_to_consider, restrict_countries))
 
 
-def _get_matches(combination: str, token_start_idx: List[int], start_idx: int, normalize_func: Callable,
-                 match_threshold: float, match_threshold_small: float, threshold_small: int,
+def _get_matches(combination: str, str_start_idx: int, normalize_func: Callable, match_threshold: float,
+                 match_threshold_small: float, threshold_small: int,
                  restrict_countries: Optional[Set]) -> Optional[ExtractedLocation]:
     """
     Try to find a matching location using the normalization function. If we find any matches, we store the one with the
-    highest score and additionally store the start and end idx of the substring. Note that we add start_idx, to
-    accommodate for the spaces after each word (which were lost after calling .split()) in the _find_in_string function.
+    highest score and additionally store the start and end idx of the substring.
 
     :param combination: combination string
-    :param token_start_idx: list of token start indices
-    :param start_idx: start index of the current combination
-    :param normalize_func: normalization function for countries/cities/regions
+    :param str_start_idx: start index of the combination in the sample
+    :param normalize_func: normalization function for countries/cities/regions, which returns candidates sorted by
+        score (desc)
     :param match_threshold: threshold for considering a substring a match
     :param match_threshold_small: threshold for considering a substring a match, applied to smaller normalized countries
     :param threshold_small: if the length of a candidate string is <= ``threshold_small`` it will use the
@@ -206,10 +211,9 @@ def _get_matches(combination: str, token_start_idx: List[int], start_idx: int, n
         matches_found = normalize_func(combination, min_score_levenshtein=threshold,
                                        min_score_trigram=threshold)
     if matches_found:
-        match = max(matches_found, key=lambda match_: match_.score)
-        str_start_idx = token_start_idx[start_idx] + start_idx
+        # Candidates are sorted by score, so the first one is the best
         str_end_idx = str_start_idx + len(combination)
-        return ExtractedLocation(location=match, substring=combination,
+        return ExtractedLocation(location=matches_found[0], substring=combination,
                                  substring_range=Range(str_start_idx, str_end_idx))
 
 
@@ -229,14 +233,9 @@ def find_country_in_string(sample: str, match_threshold: float = 0.84, match_thr
         countries
     :return: list of matches
     """
-    # We skip certain tokens, as they are too confusing. The whitelist_last_resort is used for when no countries could
-    # be found. In that case we do allow to find those strings, if they're uppercase.
-    all_country_codes_lower = {cc.lower() for cc in _COUNTRY_RESOURCES['all_country_codes']}
-    blacklist = _COUNTRY_RESOURCES['all_country_codes'] | all_country_codes_lower | {'u'}
-    whitelist_last_resort = _COUNTRY_RESOURCES['all_country_codes']
-
-    return _find_in_string(sample, clean_country, normalize_country, blacklist, whitelist_last_resort,
-                           match_threshold, match_threshold_small, threshold_small, max_tokens_to_consider)
+    return list(_find_in_string_cached(sample, clean_country, normalize_country, _COUNTRY_BLACKLIST,
+                                       _COUNTRY_WHITELIST_LAST_RESORT, match_threshold, match_threshold_small,
+                                       threshold_small, max_tokens_to_consider, None))
 
 
 def find_city_in_string(sample: str, country_set: Optional[set] = None, match_threshold: float = 0.84,
@@ -257,13 +256,9 @@ def find_city_in_string(sample: str, country_set: Optional[set] = None, match_th
         countries
     :return: list of matches
     """
-    # We skip certain tokens, as they are too confusing. The whitelist_last_resort is used for when no cities could be
-    # found. In that case we do allow to find those strings.
-    blacklist = set()
-    whitelist_last_resort = set()
-
-    return _find_in_string(sample, clean_city, normalize_city, blacklist, whitelist_last_resort, match_threshold,
-                           match_threshold_small, threshold_small, max_tokens_to_consider, country_set)
+    return list(_find_in_string_cached(sample, clean_city, normalize_city, _NO_BLACKLIST, _NO_WHITELIST_LAST_RESORT,
+                                       match_threshold, match_threshold_small, threshold_small, max_tokens_to_consider,
+                                       None if country_set is None else frozenset(country_set)))
 
 
 def find_region_in_string(sample: str, country_set: Optional[set] = None, match_threshold: float = 0.84,
@@ -284,13 +279,9 @@ def find_region_in_string(sample: str, country_set: Optional[set] = None, match_
         countries
     :return: list of matches
     """
-    # We skip certain tokens, as they are too confusing. The whitelist_last_resort is used for when no regions could be
-    # found. In that case we do allow to find those strings.
-    blacklist = set()
-    whitelist_last_resort = set()
-
-    return _find_in_string(sample, clean_region, normalize_region, blacklist, whitelist_last_resort, match_threshold,
-                           match_threshold_small, threshold_small, max_tokens_to_consider, country_set)
+    return list(_find_in_string_cached(sample, clean_region, normalize_region, _NO_BLACKLIST, _NO_WHITELIST_LAST_RESORT,
+                                       match_threshold, match_threshold_small, threshold_small, max_tokens_to_consider,
+                                       None if country_set is None else frozenset(country_set)))
 
 
 def _precompute_bounds_find_in_string() -> None:
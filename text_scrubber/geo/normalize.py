@@ -1,8 +1,9 @@
-import re
+import string
 import warnings
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Iterable, List, Optional, Set
+from functools import lru_cache
+from typing import FrozenSet, Iterable, List, Optional, Set, Tuple
 
 from text_scrubber.geo.clean import clean_city, clean_country, clean_region
 from text_scrubber.geo.resources import (_CITY_RESOURCES, _COUNTRY_RESOURCES, _REGION_RESOURCES,
@@ -10,7 +11,12 @@ from text_scrubber.geo.resources import (_CITY_RESOURCES, _COUNTRY_RESOURCES, _R
 from text_scrubber.geo.string_distance import find_closest_string, pattern_match
 
 
-RE_ALPHA = re.compile(r'[a-zA-Z]')
+# Translation table that removes ASCII letters, used for counting the other characters in a name
+_ASCII_LETTERS_DELETE_TABLE = str.maketrans('', '', string.ascii_letters)
+
+# Maximum number of cleaned inputs for which the normalized locations are cached. Geo fields in real data sets tend to
+# repeat a lot, so this avoids redoing the same fuzzy lookups over and over again
+_NORMALIZE_CACHE_SIZE = 65536
 
 
 @dataclass(init=True, frozen=True)
@@ -46,15 +52,48 @@ def normalize_country(country: str, min_score_levenshtein: float = 0.8,
     # Check if country is part of the known countries list
     if cleaned_country in _COUNTRY_RESOURCES['countries']['cleaned_location_map']:
         canonical_country_idx, country_idx = _COUNTRY_RESOURCES['countries']['cleaned_location_map'][cleaned_country]
-        return [Location(canonical_name=canonical_country_names[canonical_country_idx],
-                         matched_name=canonical_country_names[country_idx], country=None, score=1.0)]
+        return [_get_exact_country_location(canonical_country_names[canonical_country_idx],
+                                            canonical_country_names[country_idx])]
 
     # Check if the country follows a certain country pattern
-    known_country = pattern_match(country, _COUNTRY_RESOURCES['replacement_patterns'])
+    known_country = pattern_match(country, _COUNTRY_RESOURCES['replacement_pattern'],
+                                  _COUNTRY_RESOURCES['replacement_pattern_map'])
     if known_country:
         canonical_country_idx, _ = _COUNTRY_RESOURCES['countries']['cleaned_location_map'][known_country]
-        return [Location(canonical_name=canonical_country_names[canonical_country_idx],
-                         matched_name=capitalize_geo_string(known_country), country=None, score=1.0)]
+        return [_get_exact_country_location(canonical_country_names[canonical_country_idx],
+                                            capitalize_geo_string(known_country))]
+
+    # Check if we can find a close match
+    return list(_find_closest_countries(cleaned_country, min_score_levenshtein, min_score_trigram))
+
+
+@lru_cache(maxsize=None)
+def _get_exact_country_location(canonical_name: str, matched_name: str) -> Location:
+    """
+    Returns the location of an exact country match. Locations are immutable, so the same object can be returned each
+    time, which saves constructing a frozen dataclass for every lookup. There are only as many exact matches as there
+    are country names in the resources, so the cache is unbounded.
+
+    :param canonical_name: canonical country name
+    :param matched_name: country name that was matched
+    :return: Location with a score of 1.0
+    """
+    return Location(canonical_name=canonical_name, matched_name=matched_name, country=None, score=1.0)
+
+
+@lru_cache(maxsize=_NORMALIZE_CACHE_SIZE)
+def _find_closest_countries(cleaned_country: str, min_score_levenshtein: float,
+                            min_score_trigram: float) -> Tuple[Location, ...]:
+    """
+    Finds the countries closest to an already cleaned country string. Results are cached, as the country resources
+    never change after loading
+
+    :param cleaned_country: Cleaned country string
+    :param min_score_levenshtein: Minimum score to use for Levenshtein similarity
+    :param min_score_trigram: Minimum score to use for trigram similarity
+    :return: Tuple of Location candidates sorted by score (desc)
+    """
+    canonical_country_names = _COUNTRY_RESOURCES['countries']['canonical_names']
 
     # Check if we can find a close match (using default threshold of 0.8 (magic number))
     country_match = find_closest_string(cleaned_country, _COUNTRY_RESOURCES['countries'],
@@ -71,10 +110,10 @@ def normalize_country(country: str, min_score_levenshtein: float = 0.8,
             dedupe_key = (clean_country(candidate.canonical_name), candidate.score)
             deduped_candidates[dedupe_key].append(candidate)
         candidates = [process_multiple_names(candidates) for candidates in deduped_candidates.values()]
-        return sorted(candidates, key=lambda x: (-x.score, x.canonical_name))
+        return tuple(sorted(candidates, key=lambda x: (-x.score, x.canonical_name)))
 
     # No match found
-    return []
+    return ()
 
 
 def normalize_region(region: str, restrict_countries: Optional[Set] = None, min_score_levenshtein: float = 0.8,
@@ -95,9 +134,25 @@ def normalize_region(region: str, restrict_countries: Optional[Set] = None, min_
     if not cleaned_region:
         return []
 
+    # Look up the region in the countries to search in
+    country_codes = _get_country_codes(None if restrict_countries is None else frozenset(restrict_countries))
+    return list(_find_closest_regions(cleaned_region, country_codes, min_score_levenshtein, min_score_trigram))
+
+
+@lru_cache(maxsize=_NORMALIZE_CACHE_SIZE)
+def _find_closest_regions(cleaned_region: str, country_codes: FrozenSet[str], min_score_levenshtein: float,
+                          min_score_trigram: float) -> Tuple[Location, ...]:
+    """
+    Finds the regions closest to an already cleaned region string. Results are cached, as the region resources of a
+    country never change after loading
+
+    :param cleaned_region: Cleaned region string
+    :param country_codes: Set of country codes to search in
+    :param min_score_levenshtein: Minimum score to use for Levenshtein similarity
+    :param min_score_trigram: Minimum score to use for trigram similarity
+    :return: Tuple of Location candidates sorted by score (desc)
+    """
     # Add region resources for countries to search in
-    country_codes = (_COUNTRY_RESOURCES['all_country_codes'] if restrict_countries is None else
-                     normalize_country_to_country_codes(restrict_countries))
     add_region_resources(country_codes)
 
     # Check if region is part of the known region list
@@ -135,7 +190,7 @@ def normalize_region(region: str, restrict_countries: Optional[Set] = None, min_
         dedupe_key = (clean_region(candidate.canonical_name), candidate.country, candidate.score)
         deduped_candidates[dedupe_key].append(candidate)
     candidates = [process_multiple_names(candidates) for candidates in deduped_candidates.values()]
-    return sorted(candidates, key=lambda x: (-x.score, x.canonical_name, x.country))
+    return tuple(sorted(candidates, key=lambda x: (-x.score, x.canonical_name, x.country)))
 
 
 def normalize_city(city: str, restrict_countries: Optional[Set] = None, min_score_levenshtein: float = 0.8,
@@ -156,9 +211,25 @@ def normalize_city(city: str, restrict_countries: Optional[Set] = None, min_scor
     if not cleaned_city:
         return []
 
+    # Look up the city in the countries to search in
+    country_codes = _get_country_codes(None if restrict_countries is None else frozenset(restrict_countries))
+    return list(_find_closest_cities(cleaned_city, country_codes, min_score_levenshtein, min_score_trigram))
+
+
+@lru_cache(maxsize=_NORMALIZE_CACHE_SIZE)
+def _find_closest_cities(cleaned_city: str, country_codes: FrozenSet[str], min_score_levenshtein: float,
+                         min_score_trigram: float) -> Tuple[Location, ...]:
+    """
+    Finds the cities closest to an already cleaned city string. Results are cached, as the city resources of a
+    country never change after loading
+
+    :param cleaned_city: Cleaned city string
+    :param country_codes: Set of country codes to search in
+    :param min_score_levenshtein: Minimum score to use for Levenshtein similarity
+    :param min_score_trigram: Minimum score to use for trigram similarity
+    :return: Tuple of Location candidates sorted by score (desc)
+    """
     # Add city resources for countries to search in
-    country_codes = (_COUNTRY_RESOURCES['all_country_codes'] if restrict_countries is None else
-                     normalize_country_to_country_codes(restrict_countries))
     add_city_resources(country_codes)
 
     # Check if city is part of the known cities list
@@ -197,7 +268,50 @@ def normalize_city(city: str, restrict_countries: Optional[Set] = None, min_scor
         dedupe_key = (clean_city(candidate.canonical_name), candidate.country, candidate.score)
         deduped_candidates[dedupe_key].append(candidate)
     candidates = [process_multiple_names(candidates) for candidates in deduped_candidates.values()]
-    return sorted(candidates, key=lambda x: (-x.score, x.canonical_name, x.country))
+    return tuple(sorted(candidates, key=lambda x: (-x.score, x.canonical_name, x.country)))
+
+
+def normalize_city_batch(cities: Iterable[str], restrict_countries: Optional[Set] = None,
+                         min_score_levenshtein: float = 0.8, min_score_trigram: float = 0.5) -> List[List[Location]]:
+    """
+    Normalizes a batch of cities. Equivalent to calling :meth:`normalize_city` for each city, but the countries to
+    search in are resolved only once and duplicate inputs are looked up only once
+
+    :param cities: Iterable of city names
+    :param restrict_countries: A set of countries and/or country codes to restrict the search space
+    :param min_score_levenshtein: minimum score to use for Levenshtein similarity
+    :param min_score_trigram: minimum score to use for trigram similarity
+    :return: List containing, for each city, a list of Location candidates sorted by score (desc)
+    """
+    # Determine the countries to search in once for all cities
+    country_codes = _get_country_codes(None if restrict_countries is None else frozenset(restrict_countries))
+
+    # Clean and look up each distinct city only once
+    matches_per_city = dict()
+    results = []
+    for city in cities:
+        if city not in matches_per_city:
+            cleaned_city = clean_city(city)
+            matches_per_city[city] = (_find_closest_cities(cleaned_city, country_codes, min_score_levenshtein,
+                                                           min_score_trigram) if cleaned_city else ())
+        results.append(list(matches_per_city[city]))
+
+    return results
+
+
+@lru_cache(maxsize=_NORMALIZE_CACHE_SIZE)
+def _get_country_codes(restrict_countries: Optional[FrozenSet] = None) -> FrozenSet[str]:
+    """
+    Determines the country codes to search in. The result is cached, such that the same countries don't have to be
+    normalized for every lookup (e.g., for every combination of tokens in ``find_city_in_string``). The same frozenset
+    is returned each time, which keeps looking it up in the ``_find_closest_*`` caches cheap.
+
+    :param restrict_countries: Set of countries and/or country codes to restrict the search space, or None to search
+        in all countries
+    :return: Frozenset of country codes
+    """
+    return frozenset(_COUNTRY_RESOURCES['all_country_codes'] if restrict_countries is None else
+                     normalize_country_to_country_codes(restrict_countries))
 
 
 def normalize_country_to_country_codes(countries: Optional[Iterable] = None) -> Set:
@@ -244,14 +358,17 @@ def process_multiple_names(candidates: List[Location]) -> Location:
     :param candidates: List of normalized location candidates
     :return: Single best candidate
     """
-    sorted_candidates = sorted(((len(RE_ALPHA.sub('', candidate.canonical_name)),
-                                 len(candidate.canonical_name),
-                                 candidate.canonical_name,
-                                 len(candidate.matched_name),
-                                 idx)
-                                for idx, candidate in enumerate(candidates)),
-                               key=lambda tup: (-tup[0], -tup[1], tup[2], tup[3], tup[4]))
-    return candidates[sorted_candidates[0][4]]
+    # Most of the time there's only one candidate
+    if len(candidates) == 1:
+        return candidates[0]
+
+    best_candidate = min((-len(candidate.canonical_name.translate(_ASCII_LETTERS_DELETE_TABLE)),
+                          -len(candidate.canonical_name),
+                          candidate.canonical_name,
+                          len(candidate.matched_name),
+                          idx)
+                         for idx, candidate in enumerate(candidates))
+    return candidates[best_candidate[4]]
 
 
 def capitalize_geo_string(string: str) -> str:
@@ -261,4 +378,4 @@ def capitalize_geo_string(string: str) -> str:
     :param string: The string to capitalize.
     :return: The capitalized string.
     """
-    return ' '.join(token if token in {'and', 'of'} else token.capitalize() for token in string.split())
+    return ' '.join([token if token in {'and', 'of'} else token.capitalize() for token in string.split()])
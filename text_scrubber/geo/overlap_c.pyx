@@ -1,7 +1,7 @@
 # cython: language_level=3
 
 import cython
-from libc.stdint cimport int32_t, int64_t
+from libc.stdint cimport int32_t, int64_t, uint8_t, uint64_t
 
 import numpy as np
 cimport numpy as np
@@ -9,8 +9,8 @@ cimport numpy as np
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def get_overlap(int32_t[:] query_vector, int32_t[:] candidates_data, int32_t[:] candidates_indptr,
-                int32_t[:] candidates_indices) -> np.ndarray:
+def get_overlap(const int32_t[::1] query_vector, const int32_t[::1] candidates_data,
+                const int32_t[::1] candidates_indptr, const int32_t[::1] candidates_indices) -> np.ndarray:
     """
     Calculates the overlap in character tokens between the query and all candidates
 
@@ -23,7 +23,7 @@ def get_overlap(int32_t[:] query_vector, int32_t[:] candidates_data, int32_t[:]
     # Create container to hold the amount of overlap
     cdef int32_t n_candidates = candidates_indptr.shape[0] - 1
     overlap = np.zeros(n_candidates, dtype=np.int32)
-    cdef int32_t[:] overlap_view = overlap
+    cdef int32_t[::1] overlap_view = overlap
 
     # Determine overlap between query and candidates
     cdef int32_t data_idx, row_idx, col_idx, row_overlap
@@ -32,6 +32,301 @@ def get_overlap(int32_t[:] query_vector, int32_t[:] candidates_data, int32_t[:]
         for data_idx in range(candidates_indptr[row_idx], candidates_indptr[row_idx + 1]):
             col_idx = candidates_indices[data_idx]
             row_overlap += min(candidates_data[data_idx], query_vector[col_idx])
-        overlap[row_idx] = row_overlap
+        overlap_view[row_idx] = row_overlap
 
     return overlap
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline int32_t _get_row_overlap(const uint64_t[::1] query_bitset, const int32_t[::1] candidates_indptr,
+                                     const int32_t[::1] candidates_indices, int64_t row_idx) nogil:
+    """
+    Calculates the overlap in trigram tokens between the query and a single candidate by testing the bit of each
+    candidate trigram in the query bitset
+
+    :param query_bitset: bitset containing the query trigram tokens
+    :param candidates_indptr: vector containing the candidate data row boundaries
+    :param candidates_indices: vector containing the flattened candidate trigram tokens
+    :param row_idx: candidate row
+    :return: overlap count
+    """
+    cdef int32_t data_idx, token, row_overlap = 0
+    for data_idx in range(candidates_indptr[row_idx], candidates_indptr[row_idx + 1]):
+        token = candidates_indices[data_idx]
+        row_overlap += (query_bitset[token >> 6] >> (token & 63)) & 1
+    return row_overlap
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def get_trigram_similarity(const uint64_t[::1] query_bitset, int32_t query_n_tokens,
+                           const int32_t[:] candidates_n_tokens, const int32_t[::1] candidates_indptr,
+                           const int32_t[::1] candidates_indices) -> np.ndarray:
+    """
+    Calculates the trigram similarity between the query and all candidates
+
+    :param query_bitset: bitset containing the query trigram tokens
+    :param query_n_tokens: number of trigram tokens available in the query
+    :param candidates_n_tokens: vector containing the number of trigram tokens available in each candidate
+    :param candidates_indptr: vector containing the candidate data row boundaries
+    :param candidates_indices: vector containing the flattened candidate trigram tokens
+    :return: vector of trigram similarity scores
+    """
+    # Create container to hold the scores
+    cdef int32_t n_candidates = candidates_indptr.shape[0] - 1
+    scores = np.zeros(n_candidates, dtype=np.float64)
+    cdef double[::1] scores_view = scores
+
+    # Determine overlap between query and candidates by testing the bit of each candidate trigram in the query bitset,
+    # and turn it into a score right away
+    cdef int32_t row_idx, row_overlap, union_size
+    with nogil:
+        for row_idx in range(n_candidates):
+            row_overlap = _get_row_overlap(query_bitset, candidates_indptr, candidates_indices, row_idx)
+            union_size = query_n_tokens + candidates_n_tokens[row_idx] - row_overlap
+            scores_view[row_idx] = <double> row_overlap / union_size if union_size else 1.0
+
+    return scores
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def get_trigram_bitset(trigram_tokens, int64_t n_bits) -> np.ndarray:
+    """
+    Packs a set of trigram tokens into a bitset of 64-bit words, where bit ``token`` is set when the token is part of
+    the set. Tokens that don't fit in ``n_bits`` are not encoded, as candidates never contain those.
+
+    :param trigram_tokens: set of trigram tokens
+    :param n_bits: number of bits to use
+    :return: bitset containing ``ceil(n_bits / 64)`` words
+    """
+    bitset = np.zeros((n_bits + 63) // 64, dtype=np.uint64)
+    cdef uint64_t[::1] bitset_view = bitset
+    cdef int64_t token
+    for token in trigram_tokens:
+        if token < n_bits:
+            bitset_view[token >> 6] |= (<uint64_t> 1) << (token & 63)
+
+    return bitset
+
+
+# Trigrams consisting of only spaces and lowercase ASCII letters (i.e., the alphabet of cleaned geo strings) are
+# encoded as base-27 numbers, which index directly into a trigram table
+cdef enum:
+    TRIGRAM_ALPHABET_SIZE = 27
+TRIGRAM_TABLE_SIZE = TRIGRAM_ALPHABET_SIZE * TRIGRAM_ALPHABET_SIZE * TRIGRAM_ALPHABET_SIZE
+
+
+cdef inline int32_t _get_trigram_char_code(Py_UCS4 char) nogil:
+    """
+    :param char: character to encode
+    :return: 0 for a space, 1-26 for lowercase ASCII letters, -1 otherwise
+    """
+    if char == u' ':
+        return 0
+    if u'a' <= char <= u'z':
+        return <int32_t> char - 96  # ord('a') == 97
+    return -1
+
+
+cdef inline int32_t _get_trigram_table_key(str trigram):
+    """
+    :param trigram: trigram to encode
+    :return: index of the trigram in the trigram table, or -1 when it contains other characters
+    """
+    cdef int32_t c0 = _get_trigram_char_code(trigram[0])
+    cdef int32_t c1 = _get_trigram_char_code(trigram[1])
+    cdef int32_t c2 = _get_trigram_char_code(trigram[2])
+    if c0 < 0 or c1 < 0 or c2 < 0:
+        return -1
+    return (c0 * TRIGRAM_ALPHABET_SIZE + c1) * TRIGRAM_ALPHABET_SIZE + c2
+
+
+def get_trigram_table(dict trigram_map) -> np.ndarray:
+    """
+    Creates a direct lookup table for the trigrams in the trigram map that consist of only spaces and lowercase ASCII
+    letters
+
+    :param trigram_map: {trigram: trigram ID} map
+    :return: table containing the trigram ID for each encoded trigram, or -1 when it isn't part of the trigram map
+    """
+    trigram_table = np.full(TRIGRAM_TABLE_SIZE, -1, dtype=np.int32)
+    cdef int32_t[::1] trigram_table_view = trigram_table
+    cdef int32_t key
+    for trigram, token in trigram_map.items():
+        if len(trigram) == 3:
+            key = _get_trigram_table_key(trigram)
+            if key >= 0:
+                trigram_table_view[key] = token
+
+    return trigram_table
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def get_trigram_tokens_from_map(str string, dict trigram_map, int32_t[::1] trigram_table) -> set:
+    """
+    Obtain a set of trigram tokens from a string that is already padded with spaces. Trigrams that are not part of the
+    trigram map yet are added to it. The trigram table is used as a fast path for trigrams consisting of only spaces and
+    lowercase ASCII letters, and is kept in sync with the trigram map
+
+    :param string: padded string to extract trigrams from
+    :param trigram_map: {trigram: trigram ID} map
+    :param trigram_table: direct lookup table mirroring the trigram map, as created by ``get_trigram_table``
+    :return: set of trigram integers
+    """
+    cdef set trigram_tokens = set()
+    cdef Py_ssize_t idx, n_chars = len(string)
+    cdef int32_t c0, c1, c2, key, token
+    cdef str trigram
+    if n_chars < 3:
+        return trigram_tokens
+
+    c1 = _get_trigram_char_code(string[0])
+    c2 = _get_trigram_char_code(string[1])
+    for idx in range(n_chars - 2):
+        c0, c1, c2 = c1, c2, _get_trigram_char_code(string[idx + 2])
+        key = (c0 * TRIGRAM_ALPHABET_SIZE + c1) * TRIGRAM_ALPHABET_SIZE + c2 if c0 >= 0 and c1 >= 0 and c2 >= 0 else -1
+        token = trigram_table[key] if key >= 0 else -1
+
+        # Fall back to the trigram map when the trigram isn't in the table
+        if token < 0:
+            trigram = string[idx:idx + 3]
+            py_token = trigram_map.get(trigram)
+            if py_token is None:
+                py_token = len(trigram_map)
+                trigram_map[trigram] = py_token
+            token = py_token
+            if key >= 0:
+                trigram_table[key] = token
+
+        trigram_tokens.add(token)
+
+    return trigram_tokens
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def get_best_trigram_candidates(const uint64_t[::1] query_bitset, int32_t query_n_tokens,
+                                const int32_t[::1] candidates_indptr, const int32_t[::1] candidates_indices,
+                                const int64_t[::1] size_offsets, int64_t size_lower_bound, int64_t size_upper_bound,
+                                double min_score):
+    """
+    Finds the candidates with the highest trigram similarity. The candidates are expected to be sorted by their number
+    of trigram tokens, where the rows of candidates with ``size`` trigram tokens are given by
+    ``size_offsets[size]:size_offsets[size + 1]``.
+
+    The similarity of a candidate can never exceed ``min(query_size, size) / max(query_size, size)``. Sizes are
+    therefore visited in descending order of this upper bound, such that we can stop as soon as the upper bound drops
+    below the best score found so far.
+
+    :param query_bitset: bitset containing the query trigram tokens
+    :param query_n_tokens: number of trigram tokens available in the query
+    :param candidates_indptr: vector containing the candidate data row boundaries
+    :param candidates_indices: vector containing the flattened candidate trigram tokens
+    :param size_offsets: vector containing the first row of each candidate size
+    :param size_lower_bound: minimum candidate size to consider (inclusive)
+    :param size_upper_bound: maximum candidate size to consider (exclusive)
+    :param min_score: minimum similarity score to obtain
+    :return: (sorted vector of best candidate rows, best score)
+    """
+    # Create container to hold the best candidates
+    best_rows = np.empty(max(size_offsets[size_upper_bound] - size_offsets[size_lower_bound], 0), dtype=np.int64)
+    cdef int64_t[::1] best_rows_view = best_rows
+    cdef int64_t n_best_rows = 0
+    cdef double best_score = min_score
+
+    cdef int64_t down_size = min(query_n_tokens, size_upper_bound - 1), up_size = max(query_n_tokens + 1,
+                                                                                       size_lower_bound)
+    cdef int64_t size, row_idx
+    cdef int32_t row_overlap
+    cdef double down_bound, up_bound, score
+    with nogil:
+        while True:
+            # Pick the size with the highest upper bound. Sizes below the query size have an upper bound of
+            # size / query_size, sizes above have query_size / size
+            down_bound = (<double> down_size / query_n_tokens) if down_size >= size_lower_bound else -1.0
+            up_bound = (<double> query_n_tokens / up_size) if up_size < size_upper_bound else -1.0
+            if down_bound < best_score and up_bound < best_score:
+                break
+            if down_bound >= up_bound:
+                size = down_size
+                down_size -= 1
+            else:
+                size = up_size
+                up_size += 1
+
+            for row_idx in range(size_offsets[size], size_offsets[size + 1]):
+                row_overlap = _get_row_overlap(query_bitset, candidates_indptr, candidates_indices, row_idx)
+                score = <double> row_overlap / (query_n_tokens + size - row_overlap)
+                if score > best_score:
+                    best_score = score
+                    n_best_rows = 0
+                if score == best_score:
+                    best_rows_view[n_best_rows] = row_idx
+                    n_best_rows += 1
+
+    return np.sort(best_rows[:n_best_rows]), best_score
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def get_best_trigram_candidates_from_postings(const uint64_t[::1] query_bitset, int32_t query_n_tokens,
+                                              const int32_t[::1] candidates_n_tokens,
+                                              const int32_t[::1] candidates_indptr,
+                                              const int32_t[::1] candidates_indices,
+                                              const int32_t[::1] postings_indptr, const int32_t[::1] postings_indices,
+                                              const int64_t[::1] tokens, int64_t start_row, int64_t end_row,
+                                              double min_score):
+    """
+    Finds the candidates with the highest trigram similarity among the candidates that occur in the postings of the
+    given trigram tokens. Only candidates within ``[start_row, end_row)`` are considered.
+
+    :param query_bitset: bitset containing the query trigram tokens
+    :param query_n_tokens: number of trigram tokens available in the query
+    :param candidates_n_tokens: vector containing the number of trigram tokens available in each candidate
+    :param candidates_indptr: vector containing the candidate data row boundaries
+    :param candidates_indices: vector containing the flattened candidate trigram tokens
+    :param postings_indptr: vector containing the postings boundaries of each trigram token
+    :param postings_indices: vector containing the flattened candidate rows of the postings
+    :param tokens: vector of trigram tokens of which the postings are used
+    :param start_row: first candidate row to consider (inclusive)
+    :param end_row: last candidate row to consider (exclusive)
+    :param min_score: minimum similarity score to obtain
+    :return: (sorted vector of best candidate rows, best score)
+    """
+    # Create containers to hold the best candidates and to keep track of which candidates have been visited already
+    best_rows = np.empty(end_row - start_row, dtype=np.int64)
+    cdef int64_t[::1] best_rows_view = best_rows
+    cdef int64_t n_best_rows = 0
+    cdef double best_score = min_score
+    visited = np.zeros(end_row - start_row, dtype=np.uint8)
+    cdef uint8_t[::1] visited_view = visited
+
+    cdef int64_t row_idx, data_idx
+    cdef Py_ssize_t token_idx
+    cdef int32_t token, row_overlap
+    cdef double score
+    with nogil:
+        for token_idx in range(tokens.shape[0]):
+            token = tokens[token_idx]
+            for data_idx in range(postings_indptr[token], postings_indptr[token + 1]):
+                row_idx = postings_indices[data_idx]
+                if row_idx < start_row or row_idx >= end_row or visited_view[row_idx - start_row]:
+                    continue
+                visited_view[row_idx - start_row] = 1
+
+                row_overlap = _get_row_overlap(query_bitset, candidates_indptr, candidates_indices, row_idx)
+                score = <double> row_overlap / (query_n_tokens + candidates_n_tokens[row_idx] - row_overlap)
+                if score > best_score:
+                    best_score = score
+                    n_best_rows = 0
+                if score == best_score:
+                    best_rows_view[n_best_rows] = row_idx
+                    n_best_rows += 1
+
+    return np.sort(best_rows[:n_best_rows]), best_score
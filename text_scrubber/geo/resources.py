@@ -1,18 +1,40 @@
+import hashlib
+import mmap
+import os
+import pickle
 import re
-from typing import Any, Dict, Callable, Generator, Optional, Set
+import warnings
+from contextlib import contextmanager, suppress
+from typing import Any, BinaryIO, Dict, Callable, Generator, Iterator, Optional, Set
 
 from tqdm.auto import tqdm
 
 from text_scrubber.io import read_resource_file, read_resource_json_file
+from text_scrubber.geo import string_distance_levenshtein, string_distance_trigrams
 from text_scrubber.geo.clean import clean_country, clean_region, clean_city
 from text_scrubber.geo.string_distance_levenshtein import optimize_levenshtein_strings
-from text_scrubber.geo.string_distance_trigrams import get_trigram_tokens, optimize_trigram_tokens
+from text_scrubber.geo.string_distance_trigrams import get_trigram_tokens, optimize_trigram_index
 
 
 _COUNTRY_RESOURCES = dict()
 _REGION_RESOURCES = {'regions_per_country_code_map': dict()}
 _CITY_RESOURCES = {'cities_per_country_code_map': dict()}
 
+# Default location of the prebuilt geo index (see build_geo_index) and the version of its format. An index with a
+# different version is ignored. Another location can be used by setting the environment variable
+_DEFAULT_GEO_INDEX_DIR = os.path.join(os.path.dirname(__file__), 'resources', 'index')
+_GEO_INDEX_DIR_ENV_VAR = 'TEXT_SCRUBBER_GEO_INDEX_DIR'
+_GEO_INDEX_VERSION = 3
+
+# Directories, relative to the resources directory, containing the resource files the geo index is built from
+_GEO_RESOURCE_DIRS = ('', 'cities_per_country', 'regions_per_country')
+
+# Alignment (in bytes) of the arrays stored in the geo index
+_GEO_INDEX_ALIGNMENT = 64
+
+# Directory of the prebuilt geo index that is in use. None when there's no (usable) index
+_GEO_INDEX_DIR = None
+
 
 def add_country_resources():
     """
@@ -32,16 +54,26 @@ def add_country_resources():
         for country_code in country_codes
     }
 
-    # Replacement patterns additional to the other replacements (mainly filters zipcodes)
-    resources['replacement_patterns'] = [(pattern, clean_country(canonical_country)) for pattern, canonical_country in
-                                         ((re.compile(r'\d+[a-z]+\d+ canada [a-z]+\d+[a-z]+', re.IGNORECASE), 'canada'),
-                                          (re.compile(r'\d+ russia', re.IGNORECASE), 'russia'))]
+    # Replacement patterns additional to the other replacements (mainly filters zipcodes). The patterns are combined
+    # into a single pattern, such that only one regex has to be matched. The name of the group that matched determines
+    # the replacement
+    replacement_patterns = ((r'\d+[a-z]+\d+ canada [a-z]+\d+[a-z]+', 'canada'),
+                            (r'\d+ russia', 'russia'))
+    resources['replacement_pattern'] = re.compile('|'.join(f'(?P<pattern_{idx}>{pattern})' for idx, (pattern, _) in
+                                                           enumerate(replacement_patterns)), re.IGNORECASE)
+    resources['replacement_pattern_map'] = {f'pattern_{idx}': clean_country(canonical_country)
+                                            for idx, (_, canonical_country) in enumerate(replacement_patterns)}
+
+    # Use the prebuilt index when available
+    resources['countries'] = _load_indexed_location_resources('countries.pkl')
+    if resources['countries'] is not None:
+        return
 
     # Get a map of cleaned country name and country code to canonical country name, and generate trigrams
     resources['countries'] = {'canonical_names': [],
                               'cleaned_location_map': dict(),
                               'levenshtein': dict(),
-                              'trigrams': dict()}
+                              'trigrams': {'trigram_tokens': [], 'indices': []}}
     for canonical_country, country_codes in resources['normalized_country_to_country_codes_map'].items():
         # Add country name
         canonical_name_idx = len(resources['countries']['canonical_names'])
@@ -101,8 +133,12 @@ def add_region_resources(country_codes: Optional[Set[str]] = None, progress_bar:
         if country_code in _REGION_RESOURCES['regions_per_country_code_map']:
             continue
 
-        regions = read_resource_file(__file__, f"resources/regions_per_country/{country_code}.txt")
-        _REGION_RESOURCES["regions_per_country_code_map"][country_code] = _add_location_resources(regions, clean_region)
+        # Use the prebuilt index when available
+        location_dict = _load_indexed_location_resources(os.path.join('regions', f'{country_code}.pkl'))
+        if location_dict is None:
+            regions = read_resource_file(__file__, f"resources/regions_per_country/{country_code}.txt")
+            location_dict = _add_location_resources(regions, clean_region)
+        _REGION_RESOURCES["regions_per_country_code_map"][country_code] = location_dict
 
 
 def add_city_resources(country_codes: Optional[Set[str]] = None, progress_bar: bool = False) -> None:
@@ -124,8 +160,12 @@ def add_city_resources(country_codes: Optional[Set[str]] = None, progress_bar: b
         if country_code in _CITY_RESOURCES['cities_per_country_code_map']:
             continue
 
-        cities = read_resource_file(__file__, f"resources/cities_per_country/{country_code}.txt")
-        _CITY_RESOURCES["cities_per_country_code_map"][country_code] = _add_location_resources(cities, clean_city)
+        # Use the prebuilt index when available
+        location_dict = _load_indexed_location_resources(os.path.join('cities', f'{country_code}.pkl'))
+        if location_dict is None:
+            cities = read_resource_file(__file__, f"resources/cities_per_country/{country_code}.txt")
+            location_dict = _add_location_resources(cities, clean_city)
+        _CITY_RESOURCES["cities_per_country_code_map"][country_code] = location_dict
 
 
 def _add_location_resources(locations: Generator[str, None, None], clean_func: Callable) -> Dict[str, Any]:
@@ -140,7 +180,7 @@ def _add_location_resources(locations: Generator[str, None, None], clean_func: C
     location_dict = {'canonical_names': [],
                      'cleaned_location_map': dict(),
                      'levenshtein': dict(),
-                     'trigrams': dict()}
+                     'trigrams': {'trigram_tokens': [], 'indices': []}}
     for location_list in locations:
         # A single line can have multiple alternative spellings of the same location. The first spelling is the
         # canonical one and all versions will point to that
@@ -185,14 +225,8 @@ def _add_cleaned_location(cleaned_location: str, canonical_name_idx: int, idx: i
         resources_dict['levenshtein'][size]['indices'].append((canonical_name_idx, idx))
 
     # Add to trigrams map
-    trigram_tokens = get_trigram_tokens(cleaned_location)
-    size = len(trigram_tokens)
-    if len(trigram_tokens) not in resources_dict['trigrams']:
-        resources_dict['trigrams'][size] = {'trigram_tokens': [trigram_tokens],
-                                            'indices': [(canonical_name_idx, idx)]}
-    else:
-        resources_dict['trigrams'][size]['trigram_tokens'].append(trigram_tokens)
-        resources_dict['trigrams'][size]['indices'].append((canonical_name_idx, idx))
+    resources_dict['trigrams']['trigram_tokens'].append(get_trigram_tokens(cleaned_location))
+    resources_dict['trigrams']['indices'].append((canonical_name_idx, idx))
 
 
 def _optimize_resources_dict(resources_dict: Dict[str, Any]) -> None:
@@ -207,9 +241,211 @@ def _optimize_resources_dict(resources_dict: Dict[str, Any]) -> None:
         locations_dict_part['char_matrix'] = char_matrix
 
     # Optimize data structure for trigrams
-    for n_trigrams, locations_dict_part in resources_dict['trigrams'].items():
-        trigram_matrix = optimize_trigram_tokens(locations_dict_part['trigram_tokens'])
-        locations_dict_part['trigram_tokens'] = trigram_matrix
+    resources_dict['trigrams'] = optimize_trigram_index(resources_dict['trigrams']['trigram_tokens'],
+                                                        resources_dict['trigrams']['indices'])
+
+
+def build_geo_index(country_codes: Optional[Set[str]] = None, index_dir: Optional[str] = None,
+                    progress_bar: bool = False) -> None:
+    """
+    Builds the country, region and city resources and stores them on disk as a prebuilt index. When the index is
+    available at import time, resources are loaded from the index instead of being parsed from the resource files,
+    which is much faster.
+
+    The index depends on the resource files and cleaning functions of the installed version of this package, so it
+    should be rebuilt after upgrading. An index that was built from other resource files is ignored at import time.
+
+    :param country_codes: Set of country codes to build region and city resources for. If None, will add all country
+        codes
+    :param index_dir: Directory to store the index in. If None, will use the directory from the
+        ``TEXT_SCRUBBER_GEO_INDEX_DIR`` environment variable, or the default location within the package when it isn't
+        set. The index is loaded from that same directory at import time
+    :param progress_bar: disable or enable progressbar. Default is no progressbar (False)
+    """
+    if country_codes is None:
+        country_codes = _COUNTRY_RESOURCES['all_country_codes']
+    if index_dir is None:
+        index_dir = _get_geo_index_dir()
+
+    add_region_resources(country_codes, progress_bar)
+    add_city_resources(country_codes, progress_bar)
+
+    # Remove the vocabularies first, such that an incomplete index is never used
+    vocabularies_path = os.path.join(index_dir, 'vocabularies.pkl')
+    if os.path.exists(vocabularies_path):
+        os.remove(vocabularies_path)
+
+    # Levenshtein and trigram IDs are only compatible with an existing index when that index is the one in use.
+    # Otherwise, the IDs have been handed out from scratch and the regions and cities stored previously have to be
+    # removed, as they would refer to other IDs
+    index_in_use = _GEO_INDEX_DIR is not None and os.path.realpath(_GEO_INDEX_DIR) == os.path.realpath(index_dir)
+    for resource_dir in ('regions', 'cities'):
+        resource_dir = os.path.join(index_dir, resource_dir)
+        os.makedirs(resource_dir, exist_ok=True)
+        if not index_in_use:
+            with os.scandir(resource_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(('.pkl', '.pkl.bin')):
+                        os.remove(entry.path)
+
+    # Store location resources
+    _dump_location_resources(os.path.join(index_dir, 'countries.pkl'), _COUNTRY_RESOURCES['countries'])
+    for country_code in country_codes:
+        _dump_location_resources(os.path.join(index_dir, 'regions', f'{country_code}.pkl'),
+                                 _REGION_RESOURCES['regions_per_country_code_map'][country_code])
+        _dump_location_resources(os.path.join(index_dir, 'cities', f'{country_code}.pkl'),
+                                 _CITY_RESOURCES['cities_per_country_code_map'][country_code])
+
+    # The location resources contain Levenshtein and trigram IDs, so we need to store the corresponding maps as well.
+    # These are stored last, as an index without vocabularies is never used
+    _dump_pickle(os.path.join(index_dir, 'vocabularies.pkl'),
+                 {'version': _GEO_INDEX_VERSION,
+                  'resources_fingerprint': _get_resources_fingerprint(),
+                  'levenshtein_map': dict(string_distance_levenshtein._LEVENSHTEIN_MAP),
+                  'trigram_map': dict(string_distance_trigrams._TRIGRAM_MAP)})
+
+
+def _load_geo_index(index_dir: str) -> None:
+    """
+    Enables the prebuilt geo index, if available, by loading its Levenshtein and trigram maps. The index can only be
+    used when no Levenshtein and trigram IDs have been handed out yet, as the IDs stored in the index would otherwise
+    conflict with them. An index that was built from other resource files is ignored.
+
+    :param index_dir: Directory where the index is stored
+    """
+    global _GEO_INDEX_DIR
+
+    vocabularies_path = os.path.join(index_dir, 'vocabularies.pkl')
+    if not os.path.exists(vocabularies_path):
+        return
+    with open(vocabularies_path, 'rb') as f:
+        vocabularies = pickle.load(f)
+
+    if (vocabularies['version'] != _GEO_INDEX_VERSION or string_distance_levenshtein._LEVENSHTEIN_MAP or
+            string_distance_trigrams._TRIGRAM_MAP):
+        return
+
+    # An index that was built from other resource files (e.g., from before upgrading) is outdated
+    if vocabularies.get('resources_fingerprint') != _get_resources_fingerprint():
+        warnings.warn(f"The geo index in {index_dir} is outdated and is not used. Rebuild it using build_geo_index")
+        return
+
+    string_distance_levenshtein._LEVENSHTEIN_MAP.update(vocabularies['levenshtein_map'])
+    string_distance_trigrams._TRIGRAM_MAP.update(vocabularies['trigram_map'])
+    _GEO_INDEX_DIR = index_dir
+
+
+def _get_geo_index_dir() -> str:
+    """
+    Determines the directory of the prebuilt geo index, which can be set using the ``TEXT_SCRUBBER_GEO_INDEX_DIR``
+    environment variable
+
+    :return: directory of the geo index
+    """
+    return os.environ.get(_GEO_INDEX_DIR_ENV_VAR) or _DEFAULT_GEO_INDEX_DIR
+
 
+def _get_resources_fingerprint() -> str:
+    """
+    Determines a fingerprint of the resource files the geo index is built from, based on their names, sizes and
+    modification times. Only the file metadata is used, such that the fingerprint is cheap to obtain at import time.
+
+    :return: fingerprint of the resource files
+    """
+    fingerprint = hashlib.sha1()
+    resources_dir = os.path.join(os.path.dirname(__file__), 'resources')
+    for resource_dir in _GEO_RESOURCE_DIRS:
+        with os.scandir(os.path.join(resources_dir, resource_dir)) as entries:
+            for entry in sorted(entries, key=lambda entry_: entry_.name):
+                if entry.is_file() and entry.name.endswith(('.json', '.txt')):
+                    stat = entry.stat()
+                    fingerprint.update(f"{resource_dir}/{entry.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return fingerprint.hexdigest()
+
+
+def _load_indexed_location_resources(resource_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Load location resources from the prebuilt geo index. The arrays are memory-mapped from the index, such that
+    multiple processes using the same index share the same physical memory. These arrays are, therefore, read-only.
+
+    :param resource_name: path to the resource, relative from the index directory
+    :return: Dictionary with processed location information, or None when not available in the index
+    """
+    if _GEO_INDEX_DIR is None:
+        return None
+
+    resource_path = os.path.join(_GEO_INDEX_DIR, resource_name)
+    if not os.path.exists(resource_path):
+        return None
+    with open(resource_path, 'rb') as f:
+        pickled_resources = pickle.load(f)
 
+    # Arrays are stored out-of-band in a separate file, which we map into memory. The memory map stays alive as long as
+    # there are arrays referring to it
+    buffers_map = memoryview(b'')
+    if os.path.getsize(f'{resource_path}.bin'):
+        with open(f'{resource_path}.bin', 'rb') as f:
+            buffers_map = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    buffers = [buffers_map[offset:offset + n_bytes] for offset, n_bytes in pickled_resources['buffers']]
+
+    return pickle.loads(pickled_resources['resources'], buffers=buffers)
+
+
+def _dump_location_resources(path: str, location_dict: Dict[str, Any]) -> None:
+    """
+    Store location resources in the geo index. Arrays are stored out-of-band in a separate ``.bin`` file, such that
+    they can be memory-mapped when loading
+
+    :param path: path of the file
+    :param location_dict: Dictionary with processed location information
+    """
+    buffers = []
+    resources = pickle.dumps(location_dict, protocol=5, buffer_callback=buffers.append)
+
+    # Store the buffers back-to-back, each aligned to make sure the arrays are aligned when mapped into memory
+    buffer_offsets = []
+    with _open_for_replace(f'{path}.bin') as f:
+        for buffer in buffers:
+            buffer = buffer.raw()
+            f.write(bytes(-f.tell() % _GEO_INDEX_ALIGNMENT))
+            buffer_offsets.append((f.tell(), buffer.nbytes))
+            f.write(buffer)
+
+    _dump_pickle(path, {'resources': resources, 'buffers': buffer_offsets})
+
+
+def _dump_pickle(path: str, obj: Any) -> None:
+    """
+    Pickle an object to a file
+
+    :param path: path of the file
+    :param obj: object to pickle
+    """
+    with _open_for_replace(path) as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+@contextmanager
+def _open_for_replace(path: str) -> Iterator[BinaryIO]:
+    """
+    Open a temporary file for writing, which replaces the file at the given path once it has been written. Files of a
+    geo index that is in use are memory-mapped, so they should never be overwritten in place. Replacing a file keeps
+    the existing memory maps pointing to the old contents
+
+    :param path: path of the file
+    :return: file object to write to
+    """
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        # The temporary file doesn't exist when it couldn't be created. Either way, the original error is raised
+        with suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+_load_geo_index(_get_geo_index_dir())
 add_country_resources()
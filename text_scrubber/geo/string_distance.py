@@ -1,4 +1,4 @@
-from typing import Dict, Iterable, List, Optional, Pattern, Set, Tuple, Union
+from typing import Dict, List, Optional, Pattern, Set, Tuple, Union
 
 from scipy.sparse import csr_matrix
 
@@ -32,14 +32,16 @@ def find_closest_string(query: str,
     return result
 
 
-def pattern_match(string: str, patterns: Iterable[Tuple[Pattern[str], str]]) -> Optional[str]:
+def pattern_match(string: str, pattern: Pattern[str], replacements: Dict[str, str]) -> Optional[str]:
     """
-    Returns the replacement string when a pattern matches the string query
+    Returns the replacement string when a pattern matches the string query. The pattern consists of alternatives, each
+    in its own named group, such that a single match determines which alternative matched
 
     :param string: string to search for
-    :param patterns: iterable of (regex patterns, replacement string) tuples
-    :return: replacement string of the fist pattern that matches, None if there's no match
+    :param pattern: regex pattern consisting of named groups, one for each alternative
+    :param replacements: {group name: replacement string} dictionary
+    :return: replacement string of the first alternative that matches, None if there's no match
     """
-    for pattern, replacement_str in patterns:
-        if pattern.match(string):
-            return replacement_str
+    match = pattern.match(string)
+    if match:
+        return replacements[match.lastgroup]
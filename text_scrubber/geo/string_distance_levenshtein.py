@@ -35,8 +35,9 @@ def find_closest_string_levenshtein(
     (size_lower_bound, size_upper_bound), overlap_lower_bounds = find_levenshtein_bounds(len(query), min_score)
     size_upper_bound = min(size_upper_bound, max(candidates.keys(), default=-1) + 1)
 
-    # Convert query to char tokens
+    # Convert query to char tokens. The query vector covers all known characters, so it can be used for each size
     query_tokens = get_char_tokens(query)
+    query_vector = get_query_vector(query_tokens, len(_LEVENSHTEIN_MAP))
 
     # Obtain scores and determine best option taking into account the minimum score threshold
     overall_best_candidates = []
@@ -51,7 +52,10 @@ def find_closest_string_levenshtein(
         indices = candidates[size]['indices']
 
         # Obtain overlap and use lower bound
-        char_overlap = get_char_overlap(query_tokens, char_matrix)
+        if char_matrix.shape[1] <= len(query_vector):
+            char_overlap = get_overlap(query_vector, char_matrix.data, char_matrix.indptr, char_matrix.indices)
+        else:
+            char_overlap = get_char_overlap(query_tokens, char_matrix)
         overlap_lower_bound = overlap_lower_bounds[size]
         above_threshold = np.where(char_overlap >= overlap_lower_bound)[0]
 
@@ -79,14 +83,22 @@ def get_char_overlap(query_tokens: List[int], char_matrix: csr_matrix) -> np.nda
         If a character occurs in a candidate than that value is incremented
     :return: vector containing number of overlapping characters
     """
-    query_vector = np.zeros(char_matrix.shape[1], dtype=np.int32)
-    for token in query_tokens:
-        if token < len(query_vector):
-            query_vector[token] += 1
-
+    query_vector = get_query_vector(query_tokens, char_matrix.shape[1])
     return get_overlap(query_vector, char_matrix.data, char_matrix.indptr, char_matrix.indices)
 
 
+def get_query_vector(query_tokens: List[int], n_chars: int) -> np.ndarray:
+    """
+    Counts the occurrences of each char token in the query. Tokens of ``n_chars`` and up are ignored.
+
+    :param query_tokens: list of char tokens
+    :param n_chars: size of the vector
+    :return: vector containing the number of occurrences of each char token
+    """
+    return np.bincount(np.array([token for token in query_tokens if token < n_chars], dtype=np.int64),
+                       minlength=n_chars).astype(np.int32)
+
+
 def get_char_tokens(query: str) -> List[int]:
     """
     Obtain a list of char tokens from a string.
@@ -111,23 +123,23 @@ def optimize_levenshtein_strings(strings: List[str]) -> csr_matrix:
     :param strings: list of strings
     :return: compressed sparse matrix that stores the number of character occurrences
     """
-    # Convert strings to a list of integers
-    string_tokens = (sorted(get_char_tokens(string)) for string in strings)
-
-    # Convert to sparse matrix format
-    data, row_ind, col_ind = [], [], []
-    for row_idx, sorted_tokens in enumerate(string_tokens):
-        prev_token = -1
-        for token in sorted_tokens:
-            if token != prev_token:
-                data.append(1)
-                row_ind.append(row_idx)
-                col_ind.append(token)
-                prev_token = token
-            else:
-                data[-1] += 1
-
-    char_matrix = csr_matrix((data, (row_ind, col_ind)))
+    # Add new characters to the map in order of first occurrence, like calling get_char_tokens on each string would
+    all_chars = ''.join(strings)
+    for char in dict.fromkeys(all_chars):
+        _LEVENSHTEIN_MAP.setdefault(char, len(_LEVENSHTEIN_MAP))
+
+    # Convert all characters to tokens in one go, by looking up the token of each unique code point
+    code_points = np.frombuffer(all_chars.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    unique_code_points, inverse = np.unique(code_points, return_inverse=True)
+    unique_tokens = np.fromiter((_LEVENSHTEIN_MAP[chr(code_point)] for code_point in unique_code_points.tolist()),
+                                dtype=np.int32, count=len(unique_code_points))
+    col_ind = unique_tokens[inverse.reshape(-1)]
+    row_ind = np.repeat(np.arange(len(strings), dtype=np.int32),
+                        np.fromiter(map(len, strings), dtype=np.int64, count=len(strings)))
+
+    # Convert to sparse matrix format. Duplicate entries are summed, which gives the character counts
+    char_matrix = csr_matrix((np.ones(len(col_ind), dtype=np.int32), (row_ind, col_ind)))
+    char_matrix.sum_duplicates()
     char_matrix.data = char_matrix.data.astype(np.int32)
     return char_matrix
 
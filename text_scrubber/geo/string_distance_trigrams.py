@@ -1,24 +1,38 @@
-from itertools import islice
+from itertools import chain
+from math import ceil
 from typing import Dict, List, Optional, Set, Tuple, Union
 
 import numpy as np
 from scipy.sparse import csr_matrix
 
+from text_scrubber.geo.overlap_c import (get_best_trigram_candidates, get_best_trigram_candidates_from_postings,
+                                         get_trigram_bitset, get_trigram_similarity, get_trigram_table,
+                                         get_trigram_tokens_from_map)
+
 # Global trigram map for storing {trigram: trigram ID} to save memory
 _TRIGRAM_MAP = {}
 
+# Direct lookup table mirroring _TRIGRAM_MAP for trigrams of cleaned strings, together with the map it mirrors. The
+# table is rebuilt when _TRIGRAM_MAP is replaced by another map
+_TRIGRAM_TABLE = get_trigram_table(_TRIGRAM_MAP)
+_TRIGRAM_TABLE_MAP = _TRIGRAM_MAP
+
 # Bounds for trigram distance
 _TRIGRAM_SIZE_BOUNDS = dict()
 
 
-def find_closest_string_trigrams(query: str, candidates: Dict[int, Dict[str, Union[csr_matrix, List[Tuple[int, int]]]]],
+def find_closest_string_trigrams(query: str,
+                                 candidates: Dict[str, Union[csr_matrix, np.ndarray, List[Tuple[int, int]]]],
                                  min_score: float) -> Optional[Tuple[List[Tuple[int, int]], float]]:
     """
-    Find the closest match for a string from a list of options using Levenshtein edit distance
+    Find the closest match for a string from a list of options using trigram similarity
 
     :param query: string to search for
-    :param candidates: {size: {'trigram_tokens': trigram matrix (csr_matrix),
-                               'indices': List of corresponding indices (Tuple[int, int])}}
+    :param candidates: {'trigram_tokens': trigram matrix with rows sorted by number of trigrams (csr_matrix),
+                        'indices': List of corresponding indices (Tuple[int, int]),
+                        'n_tokens': number of trigrams of each candidate (np.ndarray),
+                        'size_offsets': first row of each number of trigrams (np.ndarray),
+                        'trigram_postings': transposed trigram matrix (csr_matrix)}
     :param min_score: minimum similarity score to obtain (between 0.0-1.0, 1.0 being a perfect match)
     :return: (best candidates, score) when minimum score is obtained, None otherwise
     """
@@ -27,57 +41,115 @@ def find_closest_string_trigrams(query: str, candidates: Dict[int, Dict[str, Uni
 
     # Obtain bounds. Note that the upper bound can be large or even infinite (when min_score==0.0). For those cases we
     # set it to the max size that occurs in the candidates
+    size_offsets = candidates['size_offsets']
     size_lower_bound, size_upper_bound = find_trigram_bounds(len(query_trigram_tokens), min_score)
-    size_upper_bound = min(size_upper_bound, max(candidates.keys(), default=-1) + 1)
-
-    # Obtain scores and determine best candidates taking into account the minimum score threshold
-    overall_best_candidates = []
-    overall_best_score = min_score
-    for size in range(size_lower_bound, size_upper_bound):
-
-        if size not in candidates:
-            continue
-
-        trigram_matrix = candidates[size]['trigram_tokens']
-        indices = candidates[size]['indices']
+    size_upper_bound = min(size_upper_bound, len(size_offsets) - 1)
+    if size_lower_bound >= size_upper_bound:
+        return None
+
+    # As candidates are sorted by size, all candidates within bounds are found in a single contiguous block of rows
+    start_row, end_row = size_offsets[size_lower_bound], size_offsets[size_upper_bound]
+    if start_row == end_row:
+        return None
+
+    # Candidates that don't share enough trigrams with the query can't obtain the minimum score. When the minimum score
+    # is above 0.0, we only have to consider the candidates that do, which are obtained from the trigram postings. When
+    # the postings are larger than the block of candidates, it's cheaper to go over the block instead
+    trigram_matrix = candidates['trigram_tokens']
+    trigram_postings = candidates['trigram_postings']
+    posting_tokens = None
+    if min_score > 0.0:
+        # A candidate of size c needs an overlap of at least min_score * (query_size + c) / (1 + min_score) to obtain
+        # the minimum score. Such a candidate can miss at most query_size - min_overlap of the query trigrams, so it
+        # must occur in the postings of any query_size - min_overlap + 1 query trigrams. We use the rarest ones for
+        # that. Note that we use a small tolerance to make sure floating point errors don't make the overlap bound too
+        # strict
+        min_overlap = max(ceil(min_score * (len(query_trigram_tokens) + size_lower_bound) / (1 + min_score) - 1e-9), 1)
+        posting_tokens = get_posting_tokens(query_trigram_tokens, trigram_postings,
+                                            len(query_trigram_tokens) - min_overlap + 1, end_row - start_row)
+
+        # Without any tokens to use, none of the candidates can obtain the minimum score
+        if posting_tokens is not None and not len(posting_tokens):
+            return None
+
+    # Obtain the best candidates taking into account the minimum score threshold. The overlap with the query is
+    # determined by testing the bits of the candidate trigrams in a bitset of the query trigrams, which is only built
+    # once we know there are candidates to test
+    query_bitset = get_trigram_bitset(query_trigram_tokens, trigram_matrix.shape[1])
+    if posting_tokens is None:
+        best_rows, best_score = get_best_trigram_candidates(
+            query_bitset, len(query_trigram_tokens), trigram_matrix.indptr, trigram_matrix.indices, size_offsets,
+            size_lower_bound, size_upper_bound, min_score
+        )
+    else:
+        best_rows, best_score = get_best_trigram_candidates_from_postings(
+            query_bitset, len(query_trigram_tokens), candidates['n_tokens'], trigram_matrix.indptr,
+            trigram_matrix.indices, trigram_postings.indptr, trigram_postings.indices, posting_tokens, start_row,
+            end_row, min_score
+        )
+    if len(best_rows):
+        indices = candidates['indices']
+        return [indices[row_idx] for row_idx in best_rows], best_score
+
+
+def get_posting_tokens(query_trigram_tokens: Set[int], trigram_postings: csr_matrix, n_tokens: int,
+                       max_postings_size: int) -> Optional[np.ndarray]:
+    """
+    Obtain the query trigram tokens of which the postings should be used to find candidates. The rarest query trigram
+    tokens are used, such that the postings are as small as possible.
 
-        scores = trigram_similarity(query_trigram_tokens, size, trigram_matrix)
+    :param query_trigram_tokens: set of trigrams belonging to the query string
+    :param trigram_postings: transposed trigram matrix, containing the trigrams in the rows and the sorted candidate
+        rows in which they occur in the columns
+    :param n_tokens: number of query trigram tokens to use
+    :param max_postings_size: maximum total size of the postings to use
+    :return: vector of trigram tokens (empty when there are no candidates in the postings), or None when the postings
+        exceed the maximum size
+    """
+    # Trigrams that don't occur in the postings don't occur in any candidate, so they have empty postings
+    tokens = np.fromiter(query_trigram_tokens, dtype=np.int64, count=len(query_trigram_tokens))
+    tokens = tokens[tokens < trigram_postings.shape[0]]
+    n_tokens -= len(query_trigram_tokens) - len(tokens)
+    if n_tokens <= 0:
+        return tokens[:0]
 
-        # Determine best matches
-        best_score = np.max(scores)
-        if best_score >= overall_best_score:
-            best_candidates = np.where(scores == best_score)[0]
-            best_candidates = [indices[idx] for idx in best_candidates]
-            if best_score == overall_best_score:
-                overall_best_candidates.extend(best_candidates)
-            else:
-                overall_best_score = best_score
-                overall_best_candidates = best_candidates
+    postings_sizes = trigram_postings.indptr[tokens + 1] - trigram_postings.indptr[tokens]
+    rarest = np.argsort(postings_sizes, kind='stable')[:n_tokens]
+    total_postings_size = postings_sizes[rarest].sum()
+    if total_postings_size >= max_postings_size:
+        return None
 
-    if overall_best_candidates:
-        return overall_best_candidates, overall_best_score
+    # When the postings are all empty, there are no candidates to consider and the tokens can be dismissed altogether
+    return tokens[rarest] if total_postings_size else tokens[:0]
 
 
-def trigram_similarity(query_trigram_tokens: Set[int], candidates_n_tokens: int,
-                       trigram_matrix: csr_matrix) -> np.ndarray:
+def trigram_similarity(query_bitset: np.ndarray, query_n_tokens: int, candidates_n_tokens: Union[int, np.ndarray],
+                       trigram_matrix: csr_matrix, start_row: int = 0, end_row: Optional[int] = None) -> np.ndarray:
     """
-    The trigram_matrix contains the different candidates in the rows, and trigrams in the columns. We take the dot
-    product of the matrix with the query vector, which yields the number of overlapping trigrams. From there, we
-    calculate the trigram similarities.
-
-    :param query_trigram_tokens: set of trigrams belonging to the query string
-    :param candidates_n_tokens: number of trigram tokens available in the candidates
+    The trigram_matrix contains the different candidates in the rows, and trigrams in the columns. The query is given
+    as a bitset, such that the number of overlapping trigrams for each candidate can be obtained by testing the bits
+    of the candidate trigrams. From there, we calculate the trigram similarities.
+
+    :param query_bitset: bitset containing the trigrams belonging to the query string (see ``get_trigram_bitset``)
+    :param query_n_tokens: number of trigram tokens available in the query. This includes the tokens that don't occur
+        in the trigram_matrix and, therefore, aren't part of the bitset
+    :param candidates_n_tokens: number of trigram tokens available in the candidates. Either a single number for all
+        candidates or a vector with a number for each candidate
     :param trigram_matrix: the trigram_matrix contains the different candidates in the rows, and trigrams in the
         columns. If a trigram occurs in a candidate than that value is set to 1
+    :param start_row: first row of the trigram_matrix to compare against (inclusive)
+    :param end_row: last row of the trigram_matrix to compare against (exclusive). When None, all rows starting from
+        start_row are used
     :return: vector of scores
     """
-    query_vector = np.zeros(trigram_matrix.shape[1])
-    query_vector[[token for token in query_trigram_tokens if token < trigram_matrix.shape[1]]] = 1.0
+    if end_row is None:
+        end_row = trigram_matrix.shape[0]
 
-    n_overlap = trigram_matrix.dot(query_vector)
-    scores = n_overlap / (len(query_trigram_tokens) + candidates_n_tokens - n_overlap)
+    # A single number of tokens for all candidates is broadcast, such that the kernel can always index per candidate
+    candidates_n_tokens = np.broadcast_to(np.asarray(candidates_n_tokens, dtype=np.int32), (end_row - start_row,))
 
-    return scores
+    return get_trigram_similarity(query_bitset, query_n_tokens, candidates_n_tokens,
+                                  trigram_matrix.indptr[start_row:end_row + 1], trigram_matrix.indices)
 
 
 def trigram_similarity_naive(string_trigrams: Set[int], option_trigrams: Set[int]) -> float:
@@ -104,26 +176,65 @@ def get_trigram_tokens(string: str) -> Set[int]:
     :param string: string to extract trigrams from
     :return: set of trigram integers
     """
-    global _TRIGRAM_MAP
-    string = f"  {string.replace(' ', '  ')}  "
-    return {_TRIGRAM_MAP.setdefault(string[i:i + 3], len(_TRIGRAM_MAP)) for i in range(len(string) - 2)}
+    global _TRIGRAM_TABLE, _TRIGRAM_TABLE_MAP
+    if _TRIGRAM_TABLE_MAP is not _TRIGRAM_MAP:
+        _TRIGRAM_TABLE = get_trigram_table(_TRIGRAM_MAP)
+        _TRIGRAM_TABLE_MAP = _TRIGRAM_MAP
 
+    return get_trigram_tokens_from_map(f"  {string.replace(' ', '  ')}  ", _TRIGRAM_MAP, _TRIGRAM_TABLE)
 
-def optimize_trigram_tokens(trigrams: List[Set[int]]) -> csr_matrix:
+
+def optimize_trigram_tokens(trigrams: List[Set[int]], n_tokens: Optional[np.ndarray] = None) -> csr_matrix:
     """
     Optimize data structure for trigrams. It transforms a list of candidates, where each candidate is represented as a
     set of integers, to a single csr_matrix.
 
     :param trigrams: list of trigram sets
+    :param n_tokens: number of trigram tokens of each candidate. When None, it will be determined from the trigram sets
     :return: binary compressed sparse matrix that stores trigram occurrences
     """
-    row_ind, col_ind = [], []
-    for row_idx, trigram_tokens in enumerate(trigrams):
-        row_ind.extend([row_idx for _ in range(len(trigram_tokens))])
-        col_ind.extend(trigram_tokens)
-    trigram_matrix = csr_matrix(([1] * len(row_ind), (row_ind, col_ind)))
-    trigram_matrix.data = trigram_matrix.data.astype(np.int32)
-    return trigram_matrix
+    if n_tokens is None:
+        n_tokens = np.fromiter(map(len, trigrams), dtype=np.int32, count=len(trigrams))
+
+    # The row boundaries and column indices can be constructed directly, which avoids building (and converting) an
+    # intermediate coordinate matrix
+    indptr = np.zeros(len(trigrams) + 1, dtype=np.int32)
+    np.cumsum(n_tokens, out=indptr[1:])
+    indices = np.fromiter(chain.from_iterable(trigrams), dtype=np.int32, count=indptr[-1])
+    data = np.ones(len(indices), dtype=np.int32)
+    n_trigrams = int(indices.max()) + 1 if len(indices) else 0
+    return csr_matrix((data, indices, indptr), shape=(len(trigrams), n_trigrams))
+
+
+def optimize_trigram_index(trigrams: List[Set[int]], indices: List[Tuple[int, int]]
+                           ) -> Dict[str, Union[csr_matrix, np.ndarray, List[Tuple[int, int]]]]:
+    """
+    Optimize data structure for trigram matching. The candidates are sorted by their number of trigrams and stored in a
+    single csr_matrix. The size offsets contain, for each number of trigrams, the first row of the matrix having at
+    least that many trigrams. Candidates with a number of trigrams within ``[lower, upper)`` can therefore be found in
+    rows ``size_offsets[lower]`` up to ``size_offsets[upper]``. The trigram postings contain, for each trigram, the
+    sorted rows of the candidates in which it occurs.
+
+    :param trigrams: list of trigram sets
+    :param indices: list of indices corresponding to the trigram sets
+    :return: {'trigram_tokens': trigram matrix (csr_matrix), 'indices': sorted indices, 'n_tokens': number of
+        trigrams of each candidate, 'size_offsets': size offsets, 'trigram_postings': transposed trigram matrix}
+    """
+    # Sort candidates by size. Sorting is stable, so candidates of equal size keep their original order. The sizes are
+    # determined only once and are reused for building the matrix and size offsets
+    sizes = np.fromiter(map(len, trigrams), dtype=np.int32, count=len(trigrams))
+    order = np.argsort(sizes, kind='stable').tolist()
+    sizes = sizes[order]
+    trigrams = [trigrams[row_idx] for row_idx in order]
+
+    trigram_matrix = optimize_trigram_tokens(trigrams, sizes)
+    size_offsets = np.searchsorted(sizes, np.arange(sizes.max(initial=-1) + 2), side='left').astype(np.int64)
+
+    return {'trigram_tokens': trigram_matrix,
+            'indices': [indices[row_idx] for row_idx in order],
+            'n_tokens': sizes,
+            'size_offsets': size_offsets,
+            'trigram_postings': trigram_matrix.transpose().tocsr()}
 
 
 def find_trigram_bounds(query_size: int, min_score: float) -> Tuple[int, int]:
@@ -135,28 +246,27 @@ def find_trigram_bounds(query_size: int, min_score: float) -> Tuple[int, int]:
     :param min_score: minimum trigram similarity score to obtain (between 0.0-1.0, 1.0 being a perfect match)
     :return: lower (inclusive) and upper (exclusive) bound
     """
-    global _TRIGRAM_SIZE_BOUNDS
-
-    if min_score not in _TRIGRAM_SIZE_BOUNDS:
-        _TRIGRAM_SIZE_BOUNDS[min_score] = dict()
-
-    if query_size not in _TRIGRAM_SIZE_BOUNDS[min_score]:
-        # When min_score equals 0.0 this will loop on forever, so we treat this special case differently
-        if min_score == 0.0:
-            lower_bound = -1
-            upper_bound = np.inf
-
-        # Determine bounds
-        else:
-            query = set(range(query_size))
-            lower_bound = upper_bound = query_size
-            while lower_bound >= 0 and trigram_similarity_naive(query, set(islice(query, lower_bound))) >= min_score:
-                lower_bound -= 1
-            max_int = max(query)
-            while trigram_similarity_naive(query, query | {max_int + 1 + i
-                                                           for i in range(upper_bound - query_size)}) >= min_score:
-                upper_bound += 1
-
-        _TRIGRAM_SIZE_BOUNDS[min_score][query_size] = lower_bound + 1, upper_bound
-
-    return _TRIGRAM_SIZE_BOUNDS[min_score][query_size]
+    # This function is called for every query, so we optimize for the case where the bounds are already known
+    try:
+        return _TRIGRAM_SIZE_BOUNDS[min_score][query_size]
+    except KeyError:
+        pass
+
+    # When min_score equals 0.0 this will loop on forever, so we treat this special case differently
+    if min_score == 0.0:
+        lower_bound = -1
+        upper_bound = np.inf
+
+    # Determine bounds. The best a candidate can do is to either contain a subset of the query trigrams (when it's
+    # smaller), or a superset (when it's larger). The similarity is then the ratio between the smaller and larger size,
+    # so there's no need to construct actual trigram sets
+    else:
+        lower_bound = upper_bound = query_size
+        while lower_bound >= 0 and lower_bound / query_size >= min_score:
+            lower_bound -= 1
+        while query_size / upper_bound >= min_score:
+            upper_bound += 1
+
+    bounds = lower_bound + 1, upper_bound
+    _TRIGRAM_SIZE_BOUNDS.setdefault(min_score, dict())[query_size] = bounds
+    return bounds
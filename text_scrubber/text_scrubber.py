@@ -1,11 +1,18 @@
 import html
+import math
+import multiprocessing
+import os
+import pickle
 import re
+import sys
 import unicodedata
-from functools import partial
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from itertools import filterfalse
 from operator import itemgetter
 from string import punctuation
-from typing import Callable, Generator, Iterable, Literal, Match, Optional, Pattern, Union, Dict, Set
+from typing import Callable, Generator, Iterable, List, Literal, Match, Optional, Pattern, Union, Dict, Set, Tuple
 
 import ftfy
 from anyascii import anyascii
@@ -14,11 +21,21 @@ from pylatexenc.latex2text import LatexNodes2Text
 
 from text_scrubber.io import read_resource_file
 
+try:
+    import re2
+    RE2_AVAILABLE = True
+except ImportError:
+    re2 = None
+    RE2_AVAILABLE = False
+
 WholeText = str
 Token = str
 TokenizedText = Iterable[Token]
 AnyText = Union[WholeText, TokenizedText]
 
+# Minimum number of texts before transforming in parallel is worth starting worker processes for
+PARALLEL_MIN_TEXTS = 1000
+
 # Pre-initialize a pylatexenc text conversion object
 LATEX_NODES_TO_TEXT = LatexNodes2Text()
 
@@ -26,9 +43,15 @@ LATEX_NODES_TO_TEXT = LatexNodes2Text()
 RE_TOKENIZE = re.compile(r'[.,!?:;*\-()\[\]\s_\\/]+')
 RE_STRIP_QUOTES = re.compile(r'"|\'')
 RE_FIND_DIGIT = re.compile(r'\d+')
+RE_HTML_TAGS = re.compile(r'<.*?>')
+RE_HTML_CHARS = re.compile(r'&#(\d{1,3});')
+RE_LATEX_CHARS = re.compile(r"\\[Hhckbdruvt'\"~`^=.]{?\\?([a-zA-Z]+)}?|{?\\([LlOoIiJj]{1})}?{?}?")
+
+# Characters that have a special meaning in regular expressions
+REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
 
 # Read in a list of stop words
-STOP_WORDS = set(read_resource_file(__file__, 'resources/stopwords.txt'))
+STOP_WORDS = frozenset(read_resource_file(__file__, 'resources/stopwords.txt'))
 
 # The Greek alphabet
 TOKEN_MAP_GREEK = {'Α': 'Alpha', 'α': 'alpha', 'Β': 'Beta', 'β': 'beta', 'Γ': 'Gamma', 'γ': 'gamma', 'Δ': 'Delta',
@@ -38,6 +61,39 @@ TOKEN_MAP_GREEK = {'Α': 'Alpha', 'α': 'alpha', 'Β': 'Beta', 'β': 'beta', 'Γ
                    'ο': 'omicron', 'Π': 'Pi', 'π': 'pi', 'Ρ': 'Rho', 'ρ': 'rho', 'Σ': 'Sigma', 'σ': 'sigma',
                    'ς': 'sigma', 'Ϲ': 'Sigma', 'ϲ': 'sigma', 'Τ': 'Tau', 'τ': 'tau', 'Υ': 'Upsilon', 'υ': 'upsilon',
                    'Φ': 'Phi', 'φ': 'phi', 'Χ': 'Chi', 'χ': 'chi', 'Ψ': 'Psi', 'ψ': 'psi', 'Ω': 'Omega', 'ω': 'omega'}
+TRANSLATION_TABLE_GREEK = str.maketrans(TOKEN_MAP_GREEK)
+
+# Translation table that removes single and double quotes
+CLEANUP_TABLE_QUOTES = dict.fromkeys(map(ord, '"\''))
+
+
+class _ToAsciiTranslationTable(dict):
+    """
+    Translation table mapping code points to their ``anyascii`` transliteration. ``anyascii`` transliterates each
+    character independently, so we can look up characters lazily and let ``str.translate`` do the rest.
+    """
+
+    def __missing__(self, codepoint: int) -> str:
+        self[codepoint] = transliteration = anyascii(chr(codepoint))
+        return transliteration
+
+
+TRANSLATION_TABLE_TO_ASCII = _ToAsciiTranslationTable()
+
+
+class _DigitsCleanupTable(dict):
+    """
+    Translation table mapping the ordinals of all unicode digits (i.e., characters for which ``str.isdigit`` holds) to
+    None, and all other ordinals to themselves. Scanning all code points up front takes a while, so characters are
+    looked up lazily. Additional characters to remove can be added as entries mapping to None.
+    """
+
+    def __missing__(self, codepoint: int) -> Optional[int]:
+        self[codepoint] = value = None if chr(codepoint).isdigit() else codepoint
+        return value
+
+
+CLEANUP_TABLE_DIGITS = _DigitsCleanupTable()
 
 
 class TextTransformer:
@@ -58,7 +114,7 @@ class TokenTransformer(TextTransformer):
         """
         :param operation: A callable that is used to preprocess a single token.
         """
-        super().__init__(lambda X: [operation(x) for x in X])
+        super().__init__(lambda X: list(map(operation, X)))
 
 
 class TextScrubber:
@@ -75,8 +131,12 @@ class TextScrubber:
     """
 
     def __init__(self) -> None:
-        # Initialize empty pipeline
+        # Initialize empty pipeline. Next to the steps as they're added, we keep track of the operations that are
+        # actually run, where adjacent steps are fused when possible (e.g., removing digits and punctuation). For each
+        # operation we store the (fused) function and whether it's applied on tokens
         self.cleaner = []
+        self._fused_steps = []
+        self._operations = []
 
     def _add_step(self, name: str, func: Callable, on_tokens: bool) -> 'TextScrubber':
         """
@@ -88,6 +148,17 @@ class TextScrubber:
         """
         transformer = TokenTransformer(func) if on_tokens else TextTransformer(func)
         self.cleaner.append(('{}_{}'.format(name, len(self.cleaner)), transformer))
+
+        # Fuse with the previous step when possible, such that the text is scanned only once
+        if self._fused_steps and self._fused_steps[-1][1] == on_tokens:
+            fused_func = _fuse_steps(self._fused_steps[-1][0], func)
+            if fused_func is not None:
+                transformer = TokenTransformer(fused_func) if on_tokens else TextTransformer(fused_func)
+                self._fused_steps[-1] = (fused_func, on_tokens)
+                self._operations[-1] = transformer.operation
+                return self
+        self._fused_steps.append((func, on_tokens))
+        self._operations.append(transformer.operation)
         return self
 
     def text_transform(self, func: Callable[[AnyText], AnyText], name: str = 'string_transform') -> 'TextScrubber':
@@ -109,18 +180,31 @@ class TextScrubber:
         return self._add_step(name, func, True)
 
     def transform(self, s: Union[AnyText, Iterable[AnyText]], on_tokens: bool = False,
-                  to_set: bool = False) -> Union[AnyText, Iterable[AnyText]]:
+                  to_set: bool = False, n_jobs: int = 1) -> Union[AnyText, Iterable[AnyText]]:
         """
         Transform a single or multiple strings.
 
         :param s: One or multiple texts, which can either be tokenized or not.
         :param on_tokens: Whether to treat the iterable of strings as tokens or complete strings.
         :param to_set: Whether to return a set instead of a list when an iterable of strings is provided.
+        :param n_jobs: Number of worker processes to use when multiple texts are provided. A negative value (e.g., -1)
+            uses as many workers as there are CPUs, and 0 raises a ``ValueError``. Only used when there are at least
+            ``PARALLEL_MIN_TEXTS`` texts, as starting workers isn't worth it for less.
         :return: Cleaned string or set of cleaned strings.
         """
+        if n_jobs == 0:
+            raise ValueError("n_jobs should be a positive number of workers, or negative to use all CPUs")
+        if n_jobs < 0:
+            n_jobs = os.cpu_count() or 1
+
         if on_tokens or isinstance(s, (str, bytes)):
-            return next(iter(self._transform((s,))))
+            return self._transform_single(s)
         else:
+            if n_jobs > 1:
+                s = list(s)
+                if len(s) >= PARALLEL_MIN_TEXTS:
+                    cleaned_s = self._transform_parallel(s, n_jobs)
+                    return set(cleaned_s) if to_set else cleaned_s
             cleaned_s = self._transform(s)
             return set(cleaned_s) if to_set else list(cleaned_s)
 
@@ -137,11 +221,52 @@ class TextScrubber:
         """
         Calls the entire cleaning pipeline on the iterable of strings.
 
+        Each step transforms each string independently, so instead of chaining a generator per step we pass each string
+        through all steps at once.
+
         :param s: Iterable of strings to transform.
         :return: Cleaned string.
         """
-        for _, transform in self.cleaner:
-            s = transform.transform(s)
+        return map(self._transform_single, s)
+
+    def _transform_parallel(self, s: List[AnyText], n_jobs: int) -> List[AnyText]:
+        """
+        Calls the entire cleaning pipeline on a list of strings using multiple worker processes.
+
+        Pipelines often contain lambdas, which can't be pickled. On Linux, workers are therefore forked, such that they
+        inherit the pipeline instead of receiving it through pickling. Only the texts and results are pickled. Other
+        platforms use their default start method, as forking isn't safe there (e.g., with macOS system frameworks). The
+        pipeline is then pickled, and when that's not possible the texts are transformed in the current process instead.
+
+        :param s: List of strings to transform.
+        :param n_jobs: Number of worker processes to use.
+        :return: List of cleaned strings.
+        """
+        if sys.platform.startswith('linux'):
+            mp_context = multiprocessing.get_context('fork')
+        else:
+            mp_context = None
+            try:
+                pickle.dumps(self)
+            except (AttributeError, pickle.PicklingError, TypeError):
+                warnings.warn("The pipeline can't be pickled, so it can't be sent to worker processes on this "
+                              "platform. Transforming without workers instead")
+                return list(self._transform(s))
+
+        chunk_size = math.ceil(len(s) / (n_jobs * 4))
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp_context, initializer=_init_worker,
+                                 initargs=(self,)) as executor:
+            return list(executor.map(_transform_in_worker, s, chunksize=chunk_size))
+
+    def _transform_single(self, s: AnyText) -> AnyText:
+        """
+        Calls the entire cleaning pipeline on a single string.
+
+        :param s: String to transform.
+        :return: Cleaned string.
+        """
+        for operation in self._operations:
+            s = operation(s)
         return s
 
     def __repr__(self) -> str:
@@ -167,12 +292,12 @@ class TextScrubber:
         self._add_step(name, html.unescape, on_tokens)
         return self
 
-    def filter_tokens(self, test: Callable[[Token], bool] = lambda t: t, neg: bool = False,
+    def filter_tokens(self, test: Optional[Callable[[Token], bool]] = None, neg: bool = False,
                       name: str = 'filter_tokens') -> 'TextScrubber':
         """
         Filter tokens given a certain test.
 
-        :param test: Function which should return ``False`` when a token should be removed.
+        :param test: Function which should return ``False`` when a token should be removed. None to remove empty tokens.
         :param neg: Whether the test should be reversed.
         :param name: Name to give to the pipeline step.
         """
@@ -263,11 +388,8 @@ class TextScrubber:
 
                 # Try to parse the token in to a number. If it succeeds, convert to text. If not, do not convert
                 for token in tokens:
-                    try:
-                        num_words = num2words(int(token), lang=language)
-                        words.append(num_words if include_commas else num_words.replace(',', ''))
-                    except ValueError:
-                        words.append(token)
+                    num_words = _num2words(token, language, include_commas)
+                    words.append(token if num_words is None else num_words)
 
             return ' '.join(words)
 
@@ -280,7 +402,8 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        return self._add_step(name, lambda t: ''.join(char for char in t if not char.isdigit()), on_tokens)
+        remove_func = partial(_remove_characters, cleanup_table=CLEANUP_TABLE_DIGITS, ascii_characters=b'0123456789')
+        return self._add_step(name, remove_func, on_tokens)
 
     def remove_excessive_whitespace(self, on_tokens: bool = False,
                                     name: str = 'strip_excessive_whitespace') -> 'TextScrubber':
@@ -299,7 +422,7 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        return self.sub(r'<.*?>', '', on_tokens=on_tokens, name=name)
+        return self._add_step(name, _remove_html_tags, on_tokens=on_tokens)
 
     def removes_prefixes(self, prefixes: Set[str], on_tokens: bool = False,
                          name: str = 'strip_prefix') -> 'TextScrubber':
@@ -310,7 +433,11 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        return self.sub(rf"^{'|^'.join(prefixes)}", '', on_tokens=on_tokens, name=name)
+        # Prefixes are regular expressions. When they're all literal strings we can do without
+        if any(REGEX_SPECIAL_CHARS.intersection(prefix) for prefix in prefixes):
+            return self.sub(rf"^{'|^'.join(prefixes)}", '', on_tokens=on_tokens, name=name)
+        remove_func = partial(_remove_prefix, prefixes=tuple(prefixes))
+        return self._add_step(name, remove_func, on_tokens=on_tokens)
 
     def remove_punctuation(self, keep_punctuation: str = '', on_tokens: bool = False,
                            name: str = 'remove_punctuation') -> 'TextScrubber':
@@ -321,8 +448,8 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        cleanup_table = {ord(punct): None for punct in punctuation if punct not in keep_punctuation}
-        remove_func = partial(_remove_punctuation, cleanup_table=cleanup_table)
+        cleanup_table, ascii_characters = _get_punctuation_cleanup_table(keep_punctuation)
+        remove_func = partial(_remove_characters, cleanup_table=cleanup_table, ascii_characters=ascii_characters)
         return self._add_step(name, remove_func, on_tokens=on_tokens)
 
     def remove_quotes(self, on_tokens: bool = False, name: str = 'strip_quotes') -> 'TextScrubber':
@@ -332,7 +459,8 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        return self._add_step(name, lambda t: RE_STRIP_QUOTES.sub('', t), on_tokens)
+        remove_func = partial(_remove_characters, cleanup_table=CLEANUP_TABLE_QUOTES, ascii_characters=b'"\'')
+        return self._add_step(name, remove_func, on_tokens)
 
     def remove_stop_words(self, stop_words: Iterable[str] = None, name: str = 'remove_stop_words',
                           case_sensitive: bool = False) -> 'TextScrubber':
@@ -343,11 +471,14 @@ class TextScrubber:
         :param stop_words: Iterable of stop words to remove. If not provided it will use a default list of stop words.
         :param name: Name to give to the pipeline step.
         """
-        stop_words_set = set(stop_words) if stop_words else STOP_WORDS
+        # Most tokens aren't stop words, so we only check for all-caps when a token is in the set
+        stop_words_set = frozenset(stop_words) if stop_words else STOP_WORDS
         if not case_sensitive:
-            remove_func = partial(filter, lambda t: t.isupper() or t.lower() not in stop_words_set)
+            def remove_func(tokens):
+                return [t for t in tokens if t.lower() not in stop_words_set or t.isupper()]
         else:
-            remove_func = partial(filter, lambda t: t.isupper() or t not in stop_words_set)
+            def remove_func(tokens):
+                return [t for t in tokens if t not in stop_words_set or t.isupper()]
         return self._add_step(name, remove_func, on_tokens=False)
 
     def remove_suffixes(self, suffixes: Set[str], on_tokens: bool = False,
@@ -359,7 +490,13 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        return self.sub(rf"{'$|'.join(suffixes)}$", '', on_tokens=on_tokens, name=name)
+        # Suffixes are regular expressions. When they're all literal strings we can do without
+        suffixes_re = rf"{'$|'.join(suffixes)}$"
+        if any(REGEX_SPECIAL_CHARS.intersection(suffix) for suffix in suffixes):
+            return self.sub(suffixes_re, '', on_tokens=on_tokens, name=name)
+        remove_func = partial(_remove_suffix, suffixes=tuple(sorted(suffixes, key=len, reverse=True)),
+                              suffixes_re=re.compile(suffixes_re))
+        return self._add_step(name, remove_func, on_tokens=on_tokens)
 
     def sort(self, reverse: bool = False, on_tokens: bool = False, name: str = 'sort') -> 'TextScrubber':
         """
@@ -369,7 +506,7 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        return self._add_step(name, lambda tokens: sorted(tokens, reverse=reverse), on_tokens=on_tokens)
+        return self._add_step(name, partial(sorted, reverse=reverse), on_tokens=on_tokens)
 
     def strip(self, chars: str = None, on_tokens: bool = False, name: str = 'strip') -> 'TextScrubber':
         """
@@ -383,7 +520,7 @@ class TextScrubber:
         return self._add_step(name, strip_func, on_tokens)
 
     def sub(self, search: Union[str, Pattern], replace: Union[str, Callable[[Match[str]], str]],
-            on_tokens: bool = False, name: str = 'sub') -> 'TextScrubber':
+            on_tokens: bool = False, name: str = 'sub', use_re2: bool = False) -> 'TextScrubber':
         """
         Replace all occurrences of a search query with a replacement string.
 
@@ -391,8 +528,23 @@ class TextScrubber:
         :param replace: Replacement string or callable for matched groups.
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
-        """
-        search_re = re.compile(search)
+        :param use_re2: Whether to use the ``re2`` regex engine (requires ``google-re2``). It runs in linear time, which
+            avoids catastrophic backtracking. Whether it's faster than ``re`` depends on the pattern. Falls back to
+            ``re`` for compiled patterns and for patterns ``re2`` doesn't support (e.g., backreferences and
+            lookarounds).
+        """
+        if use_re2 and not RE2_AVAILABLE:
+            raise ImportError("use_re2=True requires google-re2 to be installed. Install it with "
+                              "`pip install text-scrubber[re2]`")
+
+        search_re = None
+        if use_re2 and isinstance(search, str):
+            try:
+                search_re = re2.compile(search)
+            except re2.error:
+                pass
+        if search_re is None:
+            search_re = re.compile(search)
         sub_func = partial(search_re.sub, replace)
         return self._add_step(name, sub_func, on_tokens=on_tokens)
 
@@ -403,7 +555,7 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        return self._add_step(name, lambda t: ''.join(TOKEN_MAP_GREEK.get(c, c) for c in t), on_tokens=on_tokens)
+        return self._add_step(name, lambda t: t.translate(TRANSLATION_TABLE_GREEK), on_tokens=on_tokens)
 
     def sub_html_chars(self, on_tokens: bool = False, name: str = 'sub_html_chars') -> 'TextScrubber':
         """
@@ -412,7 +564,7 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        return self.sub(r'&#(\d{1,3});', lambda m: chr(int(m.group(1))), on_tokens=on_tokens, name=name)
+        return self._add_step(name, _sub_html_chars, on_tokens=on_tokens)
 
     def sub_latex_chars(self, on_tokens: bool = False, name: str = 'sub_latex_chars') -> 'TextScrubber':
         r"""
@@ -422,8 +574,7 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        latex_re = r"\\[Hhckbdruvt'\"~`^=.]{?\\?([a-zA-Z]+)}?|{?\\([LlOoIiJj]{1})}?{?}?"
-        return self.sub(latex_re, lambda m: m.group(2) or m.group(1), on_tokens=on_tokens, name=name)
+        return self._add_step(name, _sub_latex_chars, on_tokens=on_tokens)
 
     def sub_tokens(self, func: Callable[[Token], Token], name: str = 'substitute_tokens') -> 'TextScrubber':
         """
@@ -441,7 +592,7 @@ class TextScrubber:
         :param on_tokens: Whether to transform on a list of tokens or a single string.
         :param name: Name to give to the pipeline step.
         """
-        return self._add_step(name, anyascii, on_tokens)
+        return self._add_step(name, _to_ascii, on_tokens)
 
     # Alias
     strip_accents = to_ascii
@@ -466,12 +617,172 @@ class TextScrubber:
         return self._add_step(name, func, False)
 
 
-def _remove_punctuation(text: str, cleanup_table: Dict[int, None]) -> str:
+# Text scrubber used by worker processes when transforming in parallel
+_WORKER_TEXT_SCRUBBER: Optional[TextScrubber] = None
+
+
+def _init_worker(text_scrubber: TextScrubber) -> None:
+    """
+    Stores the text scrubber to use in a worker process.
+
+    :param text_scrubber: Text scrubber to use.
+    """
+    global _WORKER_TEXT_SCRUBBER
+    _WORKER_TEXT_SCRUBBER = text_scrubber
+
+
+def _transform_in_worker(s: AnyText) -> AnyText:
     """
-    Removes punctuation from a text given a cleanup table.
+    Calls the entire cleaning pipeline of the worker's text scrubber on a single string.
+
+    :param s: String to transform.
+    :return: Cleaned string.
+    """
+    return _WORKER_TEXT_SCRUBBER._transform_single(s)
+
+
+def _fuse_steps(first: Callable, second: Callable) -> Optional[Callable]:
+    """
+    Fuses two consecutive pipeline steps into a single one, if possible. Currently, only steps that remove characters
+    (e.g., digits, punctuation, and quotes) are fused, as these can be combined into a single translation.
+
+    :param first: Function of the first step.
+    :param second: Function of the second step.
+    :return: Function performing both steps, or ``None`` when the steps can't be fused.
+    """
+    if not all(isinstance(func, partial) and func.func is _remove_characters for func in (first, second)):
+        return None
+
+    # Only copy the characters to remove. A lazy digits table also holds cached entries of characters to keep, which
+    # would otherwise overwrite removals of the other table
+    tables = first.keywords['cleanup_table'], second.keywords['cleanup_table']
+    table_type = _DigitsCleanupTable if any(isinstance(table, _DigitsCleanupTable) for table in tables) else dict
+    cleanup_table = table_type((codepoint, None) for table in tables for codepoint, value in table.items()
+                               if value is None)
+    return partial(_remove_characters, cleanup_table=cleanup_table,
+                   ascii_characters=first.keywords['ascii_characters'] + second.keywords['ascii_characters'])
+
+
+def _to_ascii(text: str) -> str:
+    """
+    Converts a text to plain 7-bit ASCII, like ``anyascii`` does.
+
+    :param text: String to convert.
+    :return: Converted string.
+    """
+    return text if text.isascii() else text.translate(TRANSLATION_TABLE_TO_ASCII)
+
+
+def _remove_characters(text: str, cleanup_table: Dict[int, None], ascii_characters: bytes) -> str:
+    """
+    Removes characters from a text given a cleanup table. ASCII texts are cleaned as bytes, which is considerably faster
+    than translating strings.
 
     :param text: String to clean.
-    :param cleanup_table: Translation tabel mapping punctuation ordinals to None.
+    :param cleanup_table: Translation table mapping the ordinals of the characters to remove to None.
+    :param ascii_characters: The ASCII characters to remove. Should correspond to the ASCII part of the cleanup table.
     :return: Cleaned string.
     """
+    if text.isascii():
+        return text.encode('ascii').translate(None, ascii_characters).decode('ascii')
     return text.translate(cleanup_table)
+
+
+def _remove_prefix(text: str, prefixes: Tuple[str, ...]) -> str:
+    """
+    Removes the first of the literal prefixes the text starts with, like ``re.sub('^prefix_1|^prefix_2|...', '', text)``
+    would.
+
+    :param text: String to clean.
+    :param prefixes: Prefixes to remove.
+    :return: Cleaned string.
+    """
+    if text.startswith(prefixes):
+        for prefix in prefixes:
+            if text.startswith(prefix):
+                return text[len(prefix):]
+    return text
+
+
+def _remove_suffix(text: str, suffixes: Tuple[str, ...], suffixes_re: Pattern) -> str:
+    """
+    Removes the longest of the literal suffixes the text ends with, like ``re.sub('suffix_1$|suffix_2$|...', '', text)``
+    would.
+
+    :param text: String to clean.
+    :param suffixes: Suffixes to remove, sorted by length (desc).
+    :param suffixes_re: Compiled regex of the suffixes. ``$`` also matches right before a trailing newline, so that case
+        is left to the regex.
+    :return: Cleaned string.
+    """
+    if text.endswith('\n'):
+        return suffixes_re.sub('', text)
+    if text.endswith(suffixes):
+        for suffix in suffixes:
+            if text.endswith(suffix):
+                return text[:len(text) - len(suffix)]
+    return text
+
+
+@lru_cache(maxsize=4096)
+def _num2words(token: str, language: str, include_commas: bool) -> Optional[str]:
+    """
+    Converts a token to words using num2words. Results are cached, as the same (small) numbers tend to occur over and
+    over again.
+
+    :param token: Token to convert.
+    :param language: The language in which to convert the number.
+    :param include_commas: Whether to let num2words include commas for more natural reading.
+    :return: The number in words, or ``None`` when the token isn't a number.
+    """
+    try:
+        num_words = num2words(int(token), lang=language)
+    except ValueError:
+        return None
+    return num_words if include_commas else num_words.replace(',', '')
+
+
+@lru_cache(maxsize=32)
+def _get_punctuation_cleanup_table(keep_punctuation: str) -> Tuple[Dict[int, None], bytes]:
+    """
+    Obtains a translation table that removes punctuation. The table is cached, such that scrubbers using the same
+    punctuation share it.
+
+    :param keep_punctuation: A string containing the punctuation-tokens that should NOT be removed.
+    :return: Translation table and the punctuation to remove as ASCII bytes.
+    """
+    remove_punctuation = ''.join(punct for punct in punctuation if punct not in keep_punctuation)
+    return dict.fromkeys(map(ord, remove_punctuation)), remove_punctuation.encode('ascii')
+
+
+def _remove_html_tags(text: str) -> str:
+    """
+    Removes HTML tags from a text. Most texts don't contain any tags, so we first do a cheap check to see if there can
+    be any before running the regex.
+
+    :param text: String to clean.
+    :return: Cleaned string.
+    """
+    return RE_HTML_TAGS.sub('', text) if '<' in text else text
+
+
+def _sub_html_chars(text: str) -> str:
+    """
+    Replaces HTML char encodings with the equivalent unicode character. The regex is only run when the text can
+    contain such an encoding.
+
+    :param text: String to clean.
+    :return: Cleaned string.
+    """
+    return RE_HTML_CHARS.sub(lambda m: chr(int(m.group(1))), text) if '&#' in text else text
+
+
+def _sub_latex_chars(text: str) -> str:
+    """
+    Replaces accented LaTeX commands and direct commands with the regular ascii character. All of these contain a
+    backslash, so the regex is only run when the text contains one.
+
+    :param text: String to clean.
+    :return: Cleaned string.
+    """
+    return RE_LATEX_CHARS.sub(lambda m: m.group(2) or m.group(1), text) if '\\' in text else text